@@ -0,0 +1,138 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from metrics import metrics
+from device_index import normalize
+
+# แคชคำตอบของคำถามที่ความหมายใกล้กัน (ไม่ต้องเรียก generate_content ซ้ำ)
+# key = ชุดสินค้าที่ค้นเจอ + ประวัติการคุย แล้วเทียบ embedding ของคำถามด้วย cosine similarity
+# คำถามที่ได้สินค้าจากดัชนีชื่อรุ่น (ไม่มี embedding) ใช้ข้อความคำถามที่ normalize แล้วเป็น key แทน
+SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+MAX_ITEMS = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+
+
+def product_ids(results):
+    ids = []
+    for item in results:
+        pid = (item.get('metadata') or {}).get('product_id') or item.get('id')
+        ids.append(str(pid))
+    return tuple(sorted(ids))
+
+
+class AnswerCache:
+    def __init__(self, threshold=SIMILARITY_THRESHOLD, ttl=TTL_SECONDS, max_items=MAX_ITEMS, version_source=None):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_items = max_items
+        # (product_ids, history_digest) -> [(unit_vector, answer, created_at), ...]
+        # (product_ids, history_digest, คำถาม) -> [(None, answer, created_at)]  (ทางดัชนีชื่อรุ่น)
+        self.groups = OrderedDict()
+        self.size = 0
+        # version_source() -> เวอร์ชันของ catalog (catalog_version.current) เปลี่ยนเมื่อไหร่ล้างแคชทั้งหมด
+        self.version_source = version_source
+        self.version = version_source() if version_source else ""
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _key(self, ids, history_text, question=None):
+        digest = hashlib.sha1((history_text or "").encode("utf-8")).hexdigest()
+        if question is None:
+            return (ids, digest)
+        return (ids, digest, " ".join(normalize(question)))
+
+    def _check_version(self):
+        version = self.version_source() if self.version_source else ""
+        if version != self.version:
+            self.groups.clear()
+            self.size = 0
+            self.version = version
+
+    def lookup(self, query_embedding, ids, history_text="", question=None):
+        # query_embedding เป็น None ได้ถ้าส่ง question มา (เทียบข้อความตรงๆ แทน cosine)
+        with self.lock:
+            self._check_version()
+            key = self._key(ids, history_text, question if query_embedding is None else None)
+            entries = self.groups.get(key) if query_embedding is not None or question is not None else None
+            if entries:
+                now = time.time()
+                fresh = [e for e in entries if now - e[2] < self.ttl]
+                self.size -= len(entries) - len(fresh)
+                self.groups[key] = fresh
+                self.groups.move_to_end(key)
+
+                if fresh and query_embedding is None:
+                    self.hits += 1
+                    return fresh[-1][1]
+                if fresh:
+                    query = np.asarray(query_embedding, dtype=np.float32)
+                    query /= np.linalg.norm(query) or 1.0
+                    vectors = np.stack([e[0] for e in fresh])
+                    scores = vectors @ query
+                    best = int(np.argmax(scores))
+                    if scores[best] >= self.threshold:
+                        self.hits += 1
+                        return fresh[best][1]
+
+            self.misses += 1
+            return None
+
+    def store(self, query_embedding, ids, answer, history_text="", question=None):
+        if not answer or (query_embedding is None and question is None):
+            return
+        query = None
+        if query_embedding is not None:
+            query = np.asarray(query_embedding, dtype=np.float32)
+            query /= np.linalg.norm(query) or 1.0
+        with self.lock:
+            self._check_version()
+            key = self._key(ids, history_text, question if query is None else None)
+            if query is None and key in self.groups:
+                # คำถามเดิมเป๊ะ เก็บแค่คำตอบล่าสุด
+                self.size -= len(self.groups[key])
+                self.groups[key] = []
+            self.groups.setdefault(key, []).append((query, answer, time.time()))
+            self.groups.move_to_end(key)
+            self.size += 1
+
+            # เกินขนาดที่กำหนด ลบกลุ่มที่ไม่ได้ใช้นานที่สุดออก
+            while self.size > self.max_items and self.groups:
+                _, removed = self.groups.popitem(last=False)
+                self.size -= len(removed)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": self.size,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+_cache = AnswerCache()
+
+
+def watch_catalog(supabase):
+    # ให้แคชหมดอายุเมื่อ catalog ใน Supabase เปลี่ยน (build_brain.py รันจากเครื่องไหนก็ตาม)
+    from catalog_version import current
+    _cache.version_source = lambda: current(supabase)
+
+
+def lookup_answer(query_embedding, results, history_text="", question=None):
+    return _cache.lookup(query_embedding, product_ids(results), history_text, question)
+
+
+def store_answer(query_embedding, results, answer, history_text="", question=None):
+    _cache.store(query_embedding, product_ids(results), answer, history_text, question)
+
+
+def cache_stats():
+    return _cache.stats()
+
+
+metrics.register("answer_cache", cache_stats)
@@ -2,7 +2,12 @@ import streamlit as st
 import google.generativeai as genai
 from supabase import create_client, Client
 from dotenv import load_dotenv
+from pipeline import live_pipeline, FailedReply
+from session_store import store
+from model_resolver import ResolvedModel
+from metrics import metrics, serve as serve_metrics
 import os
+import uuid
 
 # 1. ตั้งค่าหน้าเว็บ
 st.set_page_config(
@@ -22,139 +27,38 @@ def init_connections():
     
     if not GEMINI_KEY:
         st.error("❌ ไม่พบ API Key กรุณาตรวจสอบไฟล์ .env หรือ Secrets ใน Cloud")
-        return None, None, None
+        return None, None
 
     # Connect Gemini
     genai.configure(api_key=GEMINI_KEY)
     
-    # Auto-detect โมเดล Flash ที่ใช้ได้ (เหมือนใน main.py)
-    # แต่เลือกเฉพาะ 1.5-flash เพื่อหลีกเลี่ยง gemini-3-flash ที่มี quota น้อย
-    model_name = None
-    try:
-        # ลองหา 1.5-flash ก่อน (quota มากกว่า)
-        for m in genai.list_models():
-            if 'generateContent' in m.supported_generation_methods:
-                if 'flash' in m.name.lower() and '1.5' in m.name.lower():
-                    model_name = m.name.replace("models/", "")
-                    break
-        
-        # ถ้าไม่เจอ 1.5-flash ลองหา flash ตัวอื่น (แต่ไม่เอา 3-flash)
-        if not model_name:
-            for m in genai.list_models():
-                if 'generateContent' in m.supported_generation_methods:
-                    if 'flash' in m.name.lower() and '3' not in m.name.lower():
-                        model_name = m.name.replace("models/", "")
-                        break
-        
-        # ถ้ายังไม่เจอ ลองใช้ gemini-pro หรือ gemini-1.5-pro
-        if not model_name:
-            for m in genai.list_models():
-                if 'generateContent' in m.supported_generation_methods:
-                    if 'pro' in m.name.lower() and '1.5' in m.name.lower():
-                        model_name = m.name.replace("models/", "")
-                        break
-            
-    except Exception as e:
-        # ถ้า list_models() ไม่ได้ ใช้ default
-        model_name = 'gemini-1.5-flash'
-        st.warning(f"⚠️ ไม่สามารถหาโมเดลได้ ใช้ default: {model_name}")
-    
-    # ถ้ายังไม่เจอเลย ใช้ default
-    if not model_name:
-        model_name = 'gemini-1.5-flash'
-    
-    # สร้างโมเดล (ถ้า error จะจัดการใน get_focus_response)
-    try:
-        model = genai.GenerativeModel(model_name)
-    except Exception as e:
-        # ถ้าโมเดลที่เลือกใช้ไม่ได้ ลองหาโมเดลอื่นที่ใช้ได้
-        st.warning(f"⚠️ โมเดล {model_name} ใช้ไม่ได้ กำลังหาโมเดลอื่น...")
-        model = None
-        try:
-            for m in genai.list_models():
-                if 'generateContent' in m.supported_generation_methods:
-                    try:
-                        model = genai.GenerativeModel(m.name.replace("models/", ""))
-                        model_name = m.name.replace("models/", "")
-                        break
-                    except:
-                        continue
-        except:
-            pass
-        
-        # ถ้ายังไม่ได้ ให้ใช้ default อีกครั้ง
-        if model is None:
-            try:
-                model = genai.GenerativeModel('gemini-1.5-flash')
-                model_name = 'gemini-1.5-flash'
-            except:
-                # ถ้ายังไม่ได้เลย ให้ใช้ gemini-pro
-                model = genai.GenerativeModel('gemini-pro')
-                model_name = 'gemini-pro'
+    # หาโมเดลครั้งเดียวแล้วจำไว้ (หรือระบุเองด้วย GEMINI_MODEL)
+    # ถ้าโมเดลใช้ไม่ได้ตอน generate จะหาโมเดลใหม่ให้อัตโนมัติ
+    model = ResolvedModel()
     
     # Connect Supabase
     supabase = create_client(SUPA_URL, SUPA_KEY)
+
+    # เปิด /metrics (Prometheus) ถ้าตั้ง METRICS_PORT
+    serve_metrics()
     
-    return model, supabase, model_name
+    return model, supabase
 
-model, supabase, active_model_name = init_connections()
+model, supabase = init_connections()
 
 # 3. ฟังก์ชันสมอง AI
-def get_focus_response(user_input, history_text):
-    try:
-        # Vector Search
-        query_vec = genai.embed_content(
-            model="models/text-embedding-004",
-            content=user_input
-        )['embedding']
-
-        results = supabase.rpc(
-            "match_products",
-            {
-                "query_embedding": query_vec,
-                "match_threshold": 0.35,
-                "match_count": 5
-            }
-        ).execute()
-
-        # Context
-        context = ""
-        if results.data:
-            for item in results.data:
-                meta = item['metadata']
-                price = meta.get('price', '-')
-                link = meta.get('link', '#')
-                context += f"- {item['content']} (ราคา: {price} | Link: {link})\n"
-        else:
-            context = "ไม่พบข้อมูลสินค้าที่ตรงกับคำถาม"
-
-        # Prompt
-        final_prompt = f"""
-        คุณคือ "น้องโฟกัส" แอดมินขายฟิล์ม Focus Shield
-        [ข้อมูลสินค้า]
-        {context}
-        [ประวัติการคุย]
-        {history_text}
-        [คำถามลูกค้า]
-        {user_input}
-        
-        --- คำสั่ง ---
-        1. ทักทาย/ถามรุ่น ถ้ายังไม่รู้
-        2. เสนอทางเลือก (ใส/ด้าน/กันมอง) ถ้ารู้รุ่นแล้ว
-        3. ปิดการขาย (ราคา+ลิงก์) เมื่อรู้ครบ
-        4. ห้ามมั่วข้อมูล
-        5. ตอบสั้นๆ น่ารัก เป็นกันเอง
-        """
-        
-        response = model.generate_content(final_prompt)
-        return response.text
-    except Exception as e:
-        error_msg = str(e)
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "1") != "0"
+METRICS_PANEL = os.getenv("METRICS_PANEL", "0") == "1"
+
+pipeline = live_pipeline(supabase, model)
+
+def error_message(e):
+    error_msg = str(e)
+    
+    # จัดการ quota exceeded (429)
+    if "429" in error_msg or "quota" in error_msg.lower() or "exceeded" in error_msg.lower():
+        return """😅 ขอโทษนะคะ ตอนนี้ระบบมีผู้ใช้งานเยอะมาก ทำให้ quota หมดชั่วคราวค่ะ 
         
-        # จัดการ quota exceeded (429)
-        if "429" in error_msg or "quota" in error_msg.lower() or "exceeded" in error_msg.lower():
-            return """😅 ขอโทษนะคะ ตอนนี้ระบบมีผู้ใช้งานเยอะมาก ทำให้ quota หมดชั่วคราวค่ะ 
-            
 **วิธีแก้:**
 - รอสักครู่แล้วลองใหม่ (ประมาณ 1-2 นาที)
 - หรือลองใหม่ในวันพรุ่งนี้ (quota จะ reset ทุกวัน)
@@ -162,10 +66,10 @@ def get_focus_response(user_input, history_text):
 ถ้าต้องการใช้งานต่อเนื่อง แนะนำให้อัปเกรดเป็น paid plan ของ Google Gemini API ค่ะ
 
 ขอบคุณที่เข้าใจนะคะ 🙏"""
-        
-        # จัดการ model not found (404)
-        if "404" in error_msg or "not found" in error_msg.lower() or "not supported" in error_msg.lower():
-            return """⚠️ ไม่พบโมเดลที่ต้องการใช้งาน
+    
+    # จัดการ model not found (404)
+    if "404" in error_msg or "not found" in error_msg.lower() or "not supported" in error_msg.lower():
+        return """⚠️ ไม่พบโมเดลที่ต้องการใช้งาน
 
 **สาเหตุ:** โมเดลที่เลือกอาจไม่พร้อมใช้งานใน API version นี้
 
@@ -174,35 +78,106 @@ def get_focus_response(user_input, history_text):
 - หรือลอง refresh หน้าเว็บใหม่
 
 ถ้ายังมีปัญหา กรุณาติดต่อทีมสนับสนุนค่ะ"""
-        
-        # จัดการ error อื่นๆ
-        return f"""⚠️ เกิดข้อผิดพลาดในระบบ: {error_msg}
+    
+    # จัดการ error อื่นๆ
+    return f"""⚠️ เกิดข้อผิดพลาดในระบบ: {error_msg}
 
 กรุณาลองใหม่อีกครั้ง หรือติดต่อทีมสนับสนุนค่ะ"""
 
+def get_focus_response(user_input, history_text, timings=None):
+    try:
+        return pipeline.answer(user_input, history_text, timings)
+    except Exception as e:
+        return FailedReply(error_message(e))
+
+def stream_focus_response(user_input, history_text, timings=None):
+    # เหมือน get_focus_response แต่ส่งข้อความออกมาทีละส่วนระหว่างที่โมเดลกำลังตอบ
+    try:
+        yield from pipeline.stream(user_input, history_text, timings)
+    except Exception as e:
+        # พังกลางทาง: ส่ง FailedReply ให้หน้าเว็บแสดงแทนข้อความที่ได้มาแล้ว (ไม่ต่อท้าย)
+        yield FailedReply(error_message(e))
+
+def log_prompt_tokens(timings):
+    tokens = timings.get("prompt_tokens")
+    if tokens:
+        print(f"🧮 prompt ~{tokens['total']} tokens (สินค้า {tokens['products']}, ประวัติ {tokens['history']})")
+
+def show_metrics_panel():
+    # p50 / p95 ล่าสุดของแต่ละขั้น + ตัวนับ (ทั้ง process ไม่ใช่เฉพาะ session นี้)
+    with st.sidebar:
+        st.subheader("📊 Metrics")
+        summary = metrics.summary()
+        stages = {name.split(":", 1)[1]: s for name, s in summary.items() if name.startswith("stage:")}
+        if stages:
+            st.table([
+                {"ขั้น": stage, "p50 (ms)": round(s["p50"] * 1000, 1), "p95 (ms)": round(s["p95"] * 1000, 1), "จำนวน": s["count"]}
+                for stage, s in stages.items()
+            ])
+        sizes = {name: s for name, s in summary.items() if not name.startswith("stage:")}
+        for name, s in sizes.items():
+            st.caption(f"{name}: p50 {s['p50']:.0f} | p95 {s['p95']:.0f}")
+        st.json({**metrics.counters, **metrics.collected()}, expanded=False)
+
 # 4. UI
 st.title("🛡️ น้องโฟกัส (AI Assistant)")
-st.caption(f"Model: {active_model_name} | Powered by Supabase")
+st.caption(f"Model: {model.model_name if model else '-'} | Powered by Supabase")
 
-if "messages" not in st.session_state:
-    st.session_state.messages = [
-        {"role": "assistant", "content": "สวัสดีครับ! น้องโฟกัสยินดีให้บริการ กำลังมองหาฟิล์มรุ่นไหนอยู่ค่ะ? 😊"}
-    ]
+GREETING = "สวัสดีครับ! น้องโฟกัสยินดีให้บริการ กำลังมองหาฟิล์มรุ่นไหนอยู่ค่ะ? 😊"
 
-for msg in st.session_state.messages:
-    if msg["role"] == "user":
-        st.chat_message("user").write(msg["content"])
-    else:
-        st.chat_message("assistant", avatar="🛡️").write(msg["content"])
+# session_state เก็บแค่ id ส่วนข้อความอยู่ใน store กลาง (ข้อความล่าสุดในหน่วยความจำ ที่เก่ากว่าอยู่ใน SQLite)
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+session = store.get(st.session_state.session_id)
+if not session.next_seq:
+    store.add(session, "assistant", GREETING)
 
-if prompt := st.chat_input("พิมพ์ข้อความ..."):
-    st.chat_message("user").write(prompt)
-    st.session_state.messages.append({"role": "user", "content": prompt})
+def show_message(role, text):
+    if role == "user":
+        st.chat_message("user").write(text)
+    else:
+        st.chat_message("assistant", avatar="🛡️").write(text)
 
-    history_str = "\n".join([f"{m['role']}: {m['content']}" for m in st.session_state.messages[-4:]])
+if session.spilled:
+    with st.expander(f"ข้อความก่อนหน้า ({session.spilled} ข้อความ)"):
+        for msg in store.older(session.id):
+            st.markdown(f"**{'คุณ' if msg.role == 'user' else 'น้องโฟกัส'}:** {msg.text}")
 
-    with st.spinner("น้องโฟกัสกำลังพิมพ์..."):
-        response_text = get_focus_response(prompt, history_str)
+for msg in session.recent:
+    show_message(msg.role, msg.text)
 
-    st.chat_message("assistant", avatar="🛡️").write(response_text)
-    st.session_state.messages.append({"role": "assistant", "content": response_text})
\ No newline at end of file
+if prompt := st.chat_input("พิมพ์ข้อความ..."):
+    st.chat_message("user").write(prompt)
+    history_str = session.conversation.render()
+    timings = {}
+
+    with st.chat_message("assistant", avatar="🛡️"):
+        if STREAM_RESPONSES:
+            # แสดงคำตอบทีละส่วนทันทีที่ได้ ไม่ต้องรอจนจบ
+            placeholder = st.empty()
+            response_text = ""
+            with st.spinner("น้องโฟกัสกำลังพิมพ์..."):
+                chunks = stream_focus_response(prompt, history_str, timings)
+                first = next(chunks, "")
+            response_text = first
+            placeholder.markdown(response_text + "▌")
+            for chunk in chunks:
+                if isinstance(chunk, FailedReply):
+                    response_text = chunk
+                    break
+                response_text += chunk
+                placeholder.markdown(response_text + "▌")
+            placeholder.markdown(response_text)
+        else:
+            with st.spinner("น้องโฟกัสกำลังพิมพ์..."):
+                response_text = get_focus_response(prompt, history_str, timings)
+            st.write(response_text)
+
+    # ตอบไม่สำเร็จ ไม่เก็บคำตอบครึ่งๆ กลางๆ / ข้อความ error ไว้ในประวัติ (prompt รอบหน้าจะได้ไม่มีขยะ)
+    if not isinstance(response_text, FailedReply):
+        store.add(session, "user", prompt)
+        store.add(session, "assistant", response_text)
+    log_prompt_tokens(timings)
+
+if METRICS_PANEL:
+    show_metrics_panel()
\ No newline at end of file
@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from pipeline import FocusPipeline, STAGES, build_prompt
+from prompt_budget import BudgetedPrompt, Conversation, PROMPT_TOKEN_BUDGET
+
+# วัดเวลาแต่ละขั้นของการตอบ 1 รอบ (embed / search / prompt / generate)
+# ใช้ --fake เพื่อรันด้วยตัวจำลองในเครื่อง ไม่ต้องต่อ Gemini / Supabase
+
+
+def load_queries(path):
+    # รองรับทั้งไฟล์ข้อความ (บรรทัดละคำถาม) และ JSONL ที่มี field "question"
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            queries.append(json.loads(line)["question"] if line.startswith("{") else line)
+    return queries
+
+
+def make_router(args):
+    from intent_router import IntentRouter
+    return None if args.no_router else IntentRouter(log_path=None)
+
+
+def make_prompt_builder(args):
+    return build_prompt if args.no_prompt_budget else BudgetedPrompt(build_prompt, budget=args.prompt_budget)
+
+
+def build_fake_pipeline(args):
+    from fakes import FakeEmbedder, FakeVectorStore, FakeGenerator, synthetic_catalog, fake_device_index
+    from query_filters import parse_filters
+
+    catalog = synthetic_catalog(args.catalog_size)
+    embedder = FakeEmbedder(latency_ms=args.embed_ms, seed=args.seed)
+    store = FakeVectorStore(embedder, catalog, latency_ms=args.search_ms, seed=args.seed)
+    generator = FakeGenerator(first_token_ms=args.generate_ms, seed=args.seed)
+    devices = fake_device_index(catalog)
+    lookup = None if args.no_device_index else devices.lookup
+    parse = None if args.no_filters else (lambda text: parse_filters(text, devices))
+    return FocusPipeline(embedder, store, generator, prompt_builder=make_prompt_builder(args),
+                         use_answer_cache=args.answer_cache, router=make_router(args), lookup=lookup,
+                         parse_filters=parse)
+
+
+def build_live_pipeline(args):
+    import google.generativeai as genai
+    from supabase import create_client
+    from dotenv import load_dotenv
+    from pipeline import live_pipeline
+    from model_resolver import ResolvedModel
+
+    load_dotenv()
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+    options = dict(prompt_builder=make_prompt_builder(args), use_answer_cache=args.answer_cache, router=make_router(args))
+    if args.no_device_index:
+        options["lookup"] = None
+    if args.no_filters:
+        options["parse_filters"] = None
+    return live_pipeline(supabase, ResolvedModel(), **options)
+
+
+def run_turn(pipeline, query, stream, history_text=""):
+    timings = {}
+    started = time.perf_counter()
+    if stream:
+        text = "".join(pipeline.stream(query, history_text, timings))
+    else:
+        text = pipeline.answer(query, history_text, timings)
+    timings["total"] = time.perf_counter() - started
+    timings["reply"] = text
+    return timings
+
+
+def run_conversation(pipeline, queries, stream):
+    # ถามทุกคำถามต่อกันในบทสนทนาเดียว (ประวัติยาวขึ้นเรื่อยๆ) ใช้ดูว่า prompt / latency คงที่ไหม
+    conversation = Conversation()
+    all_timings = []
+    for query in queries:
+        timings = run_turn(pipeline, query, stream, conversation.render())
+        conversation.add("user", query)
+        conversation.add("assistant", timings["reply"])
+        all_timings.append(timings)
+    return all_timings
+
+
+def summarize(samples):
+    values = np.asarray(samples) * 1000.0
+    return {
+        "count": int(values.size),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+    }
+
+
+def run_benchmark(pipeline, queries, repeat=1, workers=1, stream=False, conversation=False):
+    workload = [q for _ in range(repeat) for q in queries]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        if conversation:
+            # 1 รอบ = 1 บทสนทนา
+            all_timings = [t for turns in pool.map(lambda _: run_conversation(pipeline, queries, stream), range(repeat))
+                           for t in turns]
+        else:
+            all_timings = list(pool.map(lambda q: run_turn(pipeline, q, stream), workload))
+    wall = time.perf_counter() - started
+
+    stages = {}
+    for stage in STAGES + ("first_chunk", "total"):
+        samples = [t[stage] for t in all_timings if stage in t]
+        if samples:
+            stages[stage] = summarize(samples)
+    # จำนวน token ของ prompt (เฉพาะรอบที่เรียก LLM)
+    tokens = [t["prompt_tokens"]["total"] for t in all_timings if "prompt_tokens" in t]
+    return {
+        "prompt_tokens": {
+            "mean": round(float(np.mean(tokens)), 1),
+            "p95": round(float(np.percentile(tokens, 95)), 1),
+            "max": int(max(tokens)),
+        } if tokens else None,
+        "turns": len(workload),
+        "wall_seconds": round(wall, 3),
+        "throughput_turns_per_sec": round(len(workload) / wall, 3) if wall else 0.0,
+        "stages": stages,
+    }
+
+
+def compare(report, baseline, tolerance):
+    # เทียบ p95 กับผลรอบก่อน คืนรายการขั้นที่ช้าลงเกิน tolerance
+    regressions = []
+    for stage, stats in report["stages"].items():
+        old = baseline.get("stages", {}).get(stage)
+        if old and old["p95_ms"] > 0 and stats["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            regressions.append((stage, old["p95_ms"], stats["p95_ms"]))
+    return regressions
+
+
+def add_pipeline_args(parser):
+    # ตัวเลือกของ pipeline / ตัวจำลอง ใช้ร่วมกับ load_test.py
+    parser.add_argument("--answer-cache", action="store_true", help="เปิดแคชคำตอบระหว่างวัด")
+    parser.add_argument("--no-router", action="store_true", help="ปิด intent router (ทุกคำถามไปถึง LLM)")
+    parser.add_argument("--no-device-index", action="store_true", help="ปิดดัชนีชื่อรุ่น (ใช้ vector search ทุกคำถาม)")
+    parser.add_argument("--no-filters", action="store_true", help="ปิดการกรองด้วยแบรนด์ / ประเภทฟิล์ม / ราคา")
+    parser.add_argument("--prompt-budget", type=int, default=PROMPT_TOKEN_BUDGET, help="งบ token ของ prompt")
+    parser.add_argument("--no-prompt-budget", action="store_true", help="ไม่จำกัดขนาด prompt")
+    parser.add_argument("--embed-ms", type=float, default=80, help="(fake) เวลากลางของ embedding")
+    parser.add_argument("--search-ms", type=float, default=60, help="(fake) เวลากลางของ match_products")
+    parser.add_argument("--generate-ms", type=float, default=400, help="(fake) เวลาถึง token แรกของ generate")
+    parser.add_argument("--catalog-size", type=int, default=None, help="(fake) จำนวนสินค้าใน catalog จำลอง")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark เวลาแต่ละขั้นของน้องโฟกัส")
+    parser.add_argument("--queries", default="eval_cases.jsonl", help="ไฟล์คำถาม (บรรทัดละคำถาม หรือ JSONL)")
+    parser.add_argument("--repeat", type=int, default=3, help="จำนวนรอบที่วนชุดคำถาม")
+    parser.add_argument("--workers", type=int, default=1, help="จำนวนคำถามที่ยิงพร้อมกัน")
+    parser.add_argument("--stream", action="store_true", help="วัดโหมด streaming (มี first_chunk)")
+    parser.add_argument("--conversation", action="store_true", help="ถามต่อกันเป็นบทสนทนาเดียว (มีประวัติการคุย)")
+    parser.add_argument("--fake", action="store_true", help="ใช้ตัวจำลองแทน Gemini / Supabase")
+    add_pipeline_args(parser)
+    parser.add_argument("--output", default="bench_results.json", help="ไฟล์ JSON ผลลัพธ์")
+    parser.add_argument("--baseline", help="ไฟล์ JSON ผลรอบก่อน ใช้ตรวจว่าช้าลงไหม")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="ยอมให้ p95 ช้าลงได้กี่เท่า (0.2 = 20%%)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    queries = load_queries(args.queries)
+    pipeline = build_fake_pipeline(args) if args.fake else build_live_pipeline(args)
+
+    print(f"⏱️ Benchmark {len(queries)} คำถาม x {args.repeat} รอบ ({'fake' if args.fake else 'live'}, {args.workers} workers)")
+    report = run_benchmark(pipeline, queries, args.repeat, args.workers, args.stream, args.conversation)
+    report["config"] = vars(args)
+
+    for stage, stats in report["stages"].items():
+        print(f"  {stage:<12} p50 {stats['p50_ms']:>9.1f} ms | p95 {stats['p95_ms']:>9.1f} ms | p99 {stats['p99_ms']:>9.1f} ms")
+    if report["prompt_tokens"]:
+        tokens = report["prompt_tokens"]
+        print(f"🧮 Prompt tokens: mean {tokens['mean']:.0f} | p95 {tokens['p95']:.0f} | max {tokens['max']}")
+    print(f"🚀 Throughput: {report['throughput_turns_per_sec']:.2f} turns/sec")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"💾 บันทึกผลที่ {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for stage, old, new in regressions:
+            print(f"⚠️ {stage} ช้าลง: p95 {old:.1f} -> {new:.1f} ms")
+        if regressions:
+            sys.exit(1)
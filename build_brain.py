@@ -1,8 +1,20 @@
 import os
+import json
 import time
+import hashlib
+import queue
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import google.generativeai as genai
 from supabase import create_client, Client
 from dotenv import load_dotenv
+import vector_index
+import device_index
+from query_filters import brand_key, film_type
+from vector_index import iter_pages
+from scheduler import scheduler
+from metrics import metrics, METRICS_FILE
 
 # 1. โหลดค่า Key
 load_dotenv()
@@ -10,57 +22,303 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
+# ค่าตั้งต้นของโหมด batch (ปรับได้ผ่าน .env หรือ argument)
+DEFAULT_BATCH_SIZE = int(os.getenv("BRAIN_BATCH_SIZE", "50"))
+DEFAULT_WORKERS = int(os.getenv("BRAIN_WORKERS", "4"))
+MAX_EMBED_BATCH = 100  # Gemini รับได้สูงสุด 100 ข้อความต่อคำขอ
+PAGE_SIZE = int(os.getenv("BRAIN_PAGE_SIZE", "1000"))       # จำนวนแถวต่อหน้าเวลาอ่านจาก Supabase
+PREFETCH_PAGES = int(os.getenv("BRAIN_PREFETCH_PAGES", "2"))  # จำนวนหน้าที่อ่านล่วงหน้าไว้ระหว่างรอ embed
+
+# ไฟล์ checkpoint เก็บ hash ของสินค้าที่บันทึกสำเร็จแล้ว
+# ระหว่างรัน ต่อท้ายเฉพาะก้อนที่สำเร็จลง STATE_LOG (ไม่เขียน JSON ทั้งไฟล์ใหม่ทุกก้อน) แล้วรวมเข้า STATE_FILE ตอนจบ
+STATE_FILE = os.getenv("BRAIN_STATE_FILE", ".brain_state.json")
+STATE_LOG = STATE_FILE + ".log"
+
 genai.configure(api_key=GEMINI_API_KEY)
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 # 2. ฟังก์ชัน Embed
-def get_gemini_embedding(text):
-    return genai.embed_content(model="models/text-embedding-004", content=text)['embedding']
+def get_gemini_embeddings(texts):
+    # ส่งหลายข้อความในคำขอเดียว ได้ list ของ vector กลับมาตามลำดับเดิม
+    # ผ่าน scheduler เพื่อให้ทุก worker ใช้ quota ร่วมกัน และ retry เองเมื่อเจอ 429 / error ชั่วคราว
+    return scheduler.run(
+        "embed",
+        lambda name: genai.embed_content(model=name, content=list(texts))['embedding'],
+        ["models/text-embedding-004"],
+        max_wait=300,
+    )
+
+# 3. แปลงข้อมูล Catalog เป็นแถวที่จะบันทึก
+def build_row(item):
+    device = item.get('devices') or {}
+    ptype = item.get('product_types') or {}
+
+    brand = device.get('brand_name', '')
+    model = device.get('model_name', '')
+    # ... (จัด Format ข้อมูลเหมือนเดิม) ...
+    text_content = f"สินค้า: {brand} {model} ประเภท: {ptype.get('main_category')} ราคา: {item.get('price')}"
+
+    metadata = {
+        "product_id": str(item.get('id')),
+        "model": model,
+        "price": item.get('price'),
+        "link": item.get('product_link'),
+        # คอลัมน์สำหรับกรองก่อนค้นหา (query_filters.py)
+        "brand": brand_key(brand),
+        "device": device_index.device_key(brand, model),
+        "film_type": film_type(ptype.get('main_category'), ptype.get('sub_category'), ptype.get('features')),
+    }
+    # hash จากข้อความ + metadata ถ้าไม่เปลี่ยนก็ไม่ต้อง embed ใหม่
+    metadata["content_hash"] = content_hash(text_content, metadata)
+    return text_content, metadata
+
+def content_hash(text_content, metadata):
+    payload = json.dumps({"content": text_content, "metadata": metadata}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def prefetch(pages, depth=PREFETCH_PAGES):
+    # อ่านหน้าถัดไปใน thread แยก ระหว่างที่หน้าปัจจุบันกำลัง embed (เก็บล่วงหน้าไม่เกิน depth หน้า)
+    buffer = queue.Queue(maxsize=max(1, depth))
+    done = object()
+
+    def produce():
+        try:
+            for page in pages:
+                buffer.put(page)
+            buffer.put(done)
+        except Exception as e:
+            buffer.put(e)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = buffer.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+# 4. Checkpoint (product_id -> content_hash)
+def load_state():
+    if os.path.exists(STATE_FILE):
+        with open(STATE_FILE, encoding="utf-8") as f:
+            state = json.load(f)
+    else:
+        # ยังไม่เคยมี checkpoint: สร้างจากข้อมูลที่อยู่ใน product_embeddings (ทีละหน้า)
+        print("🔎 ไม่พบ checkpoint กำลังอ่านสถานะจาก product_embeddings...")
+        state = {}
+        for page in iter_pages(lambda: supabase.table("product_embeddings").select("id, metadata"), page_size=PAGE_SIZE):
+            for row in page:
+                meta = row.get('metadata') or {}
+                if meta.get('product_id'):
+                    state[meta['product_id']] = meta.get('content_hash')
+
+    # ก้อนที่บันทึกสำเร็จในรอบก่อนแต่ยังไม่ได้รวมเข้าไฟล์หลัก (เช่นโปรแกรมตายกลางทาง)
+    if os.path.exists(STATE_LOG):
+        with open(STATE_LOG, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    pid, digest = json.loads(line)
+                except ValueError:
+                    continue  # บรรทัดสุดท้ายที่เขียนไม่จบ
+                state[pid] = digest
+    return state
+
+def append_state(entries):
+    # ต่อท้าย [product_id, content_hash] ของก้อนที่สำเร็จ (ใช้เวลาตามขนาดก้อน ไม่ใช่ขนาด catalog)
+    with open(STATE_LOG, "a", encoding="utf-8") as f:
+        f.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+
+def save_state(state):
+    # เขียนไฟล์ชั่วคราวก่อนแล้วค่อย rename กันไฟล์พังถ้าโปรแกรมตายกลางทาง
+    tmp_path = STATE_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, STATE_FILE)
+    # log รวมเข้าไฟล์หลักแล้ว (ถ้าตายก่อนลบ รอบหน้าอ่านซ้ำได้ผลเหมือนเดิม)
+    if os.path.exists(STATE_LOG):
+        os.remove(STATE_LOG)
+
+def delete_products(product_ids):
+    for ids in chunked(list(product_ids), 100):
+        supabase.table("product_embeddings").delete().in_("metadata->>product_id", ids).execute()
+
+def existing_row_ids(product_ids):
+    # id ของแถวที่มีอยู่แล้วของสินค้าเหล่านี้ (อ่านก่อนใส่แถวใหม่ แล้วค่อยลบทีหลัง)
+    row_ids = []
+    for ids in chunked(list(product_ids), 100):
+        rows = supabase.table("product_embeddings").select("id").in_("metadata->>product_id", ids).execute().data
+        row_ids.extend(row["id"] for row in rows)
+    return row_ids
 
-# 3. เริ่มกระบวนการอัปเดตสมอง
-print("🚀 กำลังเริ่มอัปเดตสมอง AI (Build Brain)...")
+def delete_rows(row_ids):
+    for ids in chunked(list(row_ids), 100):
+        supabase.table("product_embeddings").delete().in_("id", ids).execute()
 
-# ดึงข้อมูลจาก Catalog
-response = supabase.table("product_catalog").select(
-    "price, product_link, devices(brand_name, model_name), product_types(main_category, sub_category, features)"
-).execute()
+def delete_legacy_rows():
+    # แถวที่สร้างจากเวอร์ชันก่อน (ไม่มี product_id) เป็นแถวซ้ำ ลบทิ้งได้
+    supabase.table("product_embeddings").delete().is_("metadata->>product_id", "null").execute()
 
-products = response.data
-print(f"📦 พบสินค้า {len(products)} รายการ")
+def process_batch(batch):
+    # embed ทั้งก้อนในคำขอเดียว แล้วบันทึกแบบ bulk ในรอบเดียว
+    with metrics.span("brain_embed_batch"):
+        vectors = get_gemini_embeddings([text for text, _ in batch])
 
-# วนลูปสร้าง Vector
-count = 0
-for item in products:
+    # ใส่แถวใหม่ก่อน แล้วค่อยลบแถวเก่าของสินค้าเดียวกัน (กันแถวซ้ำ)
+    # ถ้าพังระหว่างทาง สินค้ายังค้นเจอจากแถวเก่า/ใหม่ ไม่หายไปจากการค้นหา (รอบหน้าลบแถวซ้ำให้เอง)
+    with metrics.span("brain_write_batch"):
+        old_rows = existing_row_ids([meta["product_id"] for _, meta in batch])
+        supabase.table("product_embeddings").insert([
+            {"content": text, "metadata": meta, "embedding": vec}
+            for (text, meta), vec in zip(batch, vectors)
+        ], returning="minimal").execute()
+        delete_rows(old_rows)
+    metrics.inc("brain_rows_embedded", len(batch))
+    return batch
+
+# 5. โหมด batch + worker pool
+class BatchWriter:
+    # รับแถวที่ต้อง embed ทีละหน้า ตัดเป็นก้อนแล้วส่งให้ worker ทันที (ไม่ต้องรออ่าน catalog ครบ)
+    # มีก้อนค้างอยู่ได้ไม่เกิน workers * 2 ก้อน ถ้าเต็มจะรอ ทำให้ใช้หน่วยความจำคงที่
+    def __init__(self, state, batch_size, workers):
+        self.state = state
+        self.batch_size = max(1, min(batch_size, MAX_EMBED_BATCH))
+        self.workers = max(1, workers)
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        self.slots = threading.BoundedSemaphore(self.workers * 2)
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.count = 0
+        self.failed = 0
+        self.started = time.perf_counter()
+        print(f"⚙️ โหมด batch: ก้อนละ {self.batch_size} รายการ, {self.workers} workers")
+
+    def add(self, rows):
+        self.buffer.extend(rows)
+        while len(self.buffer) >= self.batch_size:
+            self.submit(self.buffer[:self.batch_size])
+            self.buffer = self.buffer[self.batch_size:]
+
+    def submit(self, batch):
+        self.slots.acquire()
+        future = self.pool.submit(process_batch, batch)
+        future.add_done_callback(lambda f: self.done(f, batch))
+
+    def done(self, future, batch):
+        try:
+            with self.lock:
+                try:
+                    future.result()
+                except Exception as e:
+                    self.failed += len(batch)
+                    print(f"⚠️ Error (ก้อนละ {len(batch)} รายการ): {e}")
+                    return
+
+                # บันทึก checkpoint ทุกก้อนที่สำเร็จ ถ้าพังกลางทางรอบหน้าจะทำต่อจากตรงนี้
+                entries = [(meta["product_id"], meta["content_hash"]) for _, meta in batch]
+                self.state.update(entries)
+                append_state(entries)
+
+                self.count += len(batch)
+                elapsed = time.perf_counter() - self.started
+                print(f"✅ อัปเดตแล้ว {self.count} รายการ... ({self.count / elapsed:.1f} rows/sec)")
+        finally:
+            self.slots.release()
+
+    def close(self):
+        if self.buffer:
+            self.submit(self.buffer)
+            self.buffer = []
+        self.pool.shutdown(wait=True)
+        save_state(self.state)
+        if self.failed:
+            print(f"⚠️ บันทึกไม่สำเร็จ {self.failed} รายการ (รันใหม่เพื่อทำต่อ)")
+        return self.count
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="สร้าง/อัปเดต vector ของสินค้า (Build Brain)")
+    parser.add_argument("--full", action="store_true", help="embed ใหม่ทุกรายการ ไม่สนใจ checkpoint")
+    parser.add_argument("--serial", action="store_true", help="ทำทีละรายการ (เท่ากับ --batch-size 1 --workers 1)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="จำนวนข้อความต่อคำขอ embed (สูงสุด 100)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="จำนวนก้อนที่ทำพร้อมกัน")
+    return parser.parse_args()
+
+# 6. เริ่มกระบวนการอัปเดตสมอง
+if __name__ == "__main__":
+    args = parse_args()
+    if args.serial:
+        args.batch_size, args.workers = 1, 1
+    print("🚀 กำลังเริ่มอัปเดตสมอง AI (Build Brain)...")
+
+    started = time.perf_counter()
+    first_run = not os.path.exists(STATE_FILE)
+    state = load_state()
+    if first_run or args.full:
+        delete_legacy_rows()
+
+    # อ่าน catalog ทีละหน้า แล้วส่งแถวที่เปลี่ยนไป embed ทันที (หน้าถัดไปอ่านล่วงหน้าระหว่างนั้น)
+    pages = iter_pages(lambda: supabase.table("product_catalog").select(
+        "id, price, product_link, devices(brand_name, model_name), product_types(main_category, sub_category, features)"
+    ), page_size=PAGE_SIZE)
+    writer = BatchWriter(state, args.batch_size, args.workers)
+    current_ids = set()  # ในหน่วยความจำเก็บแค่ id (ใช้หาสินค้าที่ถูกลบ)
+    # ดัชนีชื่อรุ่นต้องใช้ทุกสินค้า เขียนลงไฟล์ชั่วคราวทีละหน้า แล้วค่อยสร้างดัชนีตอนจบ
+    entries_path = device_index.INDEX_PATH + ".entries.tmp"
+    total = 0
+    changed_total = 0
     try:
-        device = item.get('devices') or {}
-        ptype = item.get('product_types') or {}
-        
-        brand = device.get('brand_name', '')
-        model = device.get('model_name', '')
-        # ... (จัด Format ข้อมูลเหมือนเดิม) ...
-        text_content = f"สินค้า: {brand} {model} ประเภท: {ptype.get('main_category')} ราคา: {item.get('price')}"
-        
-        metadata = {
-            "model": model,
-            "price": item.get('price'),
-            "link": item.get('product_link')
-        }
-
-        # สร้าง Vector
-        vector = get_gemini_embedding(text_content)
-        
-        # บันทึก (ใช้ upsert หรือ insert ก็ได้)
-        supabase.table("product_embeddings").insert({
-            "content": text_content,
-            "metadata": metadata,
-            "embedding": vector
-        }).execute()
-        
-        count += 1
-        if count % 10 == 0: print(f"✅ อัปเดตแล้ว {count} รายการ...")
-        time.sleep(0)
-
-    except Exception as e:
-        print(f"⚠️ Error: {e}")
-
-print("🎉 อัปเดตสมองเสร็จสมบูรณ์!")
\ No newline at end of file
+        with open(entries_path, "w", encoding="utf-8") as entries_file:
+            for page in prefetch(pages):
+                changed = []
+                lines = []
+                for item in page:
+                    text, meta = build_row(item)
+                    current_ids.add(meta["product_id"])
+                    device = item.get('devices') or {}
+                    lines.append(json.dumps({
+                        "brand": device.get('brand_name', ''),
+                        "model": device.get('model_name', ''),
+                        "content": text,
+                        "metadata": meta,
+                    }, ensure_ascii=False) + "\n")
+                    if args.full or state.get(meta["product_id"]) != meta["content_hash"]:
+                        changed.append((text, meta))
+                entries_file.writelines(lines)
+                total += len(page)
+                changed_total += len(changed)
+                print(f"📦 อ่านสินค้าแล้ว {total} รายการ (ต้อง embed ใหม่ {changed_total} รายการ)")
+                writer.add(changed)
+    finally:
+        count = writer.close()
+    print(f"🔄 embed ใหม่ {count}/{changed_total} รายการ (ไม่เปลี่ยน {total - changed_total} รายการ)")
+
+    # ดัชนีชื่อรุ่น (ค้นจากชื่อรุ่นตรงๆ โดยไม่ต้อง embed) สร้างใหม่จาก catalog ทุกครั้ง
+    with open(entries_path, encoding="utf-8") as entries_file:
+        devices = device_index.build_index(json.loads(line) for line in entries_file)
+    os.remove(entries_path)
+    print(f"📇 อัปเดตดัชนีชื่อรุ่นแล้ว ({devices} รุ่น)")
+
+    # สินค้าที่ถูกลบออกจาก Catalog แล้ว
+    removed = [pid for pid in state if pid not in current_ids]
+    if removed:
+        delete_products(removed)
+        for pid in removed:
+            state.pop(pid, None)
+        save_state(state)
+        print(f"🗑️ ลบสินค้าที่ไม่มีแล้ว {len(removed)} รายการ")
+
+    elapsed = time.perf_counter() - started
+    print(f"⏱️ ใช้เวลา {elapsed:.1f} วินาที ({count / elapsed if elapsed else 0:.1f} rows/sec)")
+
+    # อัปเดต snapshot ของ vector index ในเครื่อง (RETRIEVAL_BACKEND=local)
+    if count or removed or not os.path.exists(os.path.join(vector_index.INDEX_DIR, vector_index.MANIFEST)):
+        indexed = vector_index.build_snapshot(supabase, page_size=PAGE_SIZE)
+        print(f"💾 อัปเดต vector index ในเครื่องแล้ว ({indexed} รายการ)")
+    if METRICS_FILE:
+        metrics.write_file(METRICS_FILE)
+        print(f"📊 บันทึก metrics ที่ {METRICS_FILE}")
+    print("🎉 อัปเดตสมองเสร็จสมบูรณ์!")
@@ -0,0 +1,48 @@
+import os
+import time
+import threading
+
+# เวอร์ชันของ catalog ที่ทุกเครื่องเห็นตรงกัน: id ล่าสุด + จำนวนแถวของ product_embeddings ใน Supabase
+# build_brain.py (รันที่เครื่องไหนก็ได้) insert แถวใหม่ / ลบแถวที่ไม่มีแล้ว ค่านี้ก็เปลี่ยนเอง ไม่ต้องพึ่งไฟล์ในเครื่อง
+# ใช้ล้างแคชคำตอบ (answer_cache.py) และสร้างดัชนีชื่อรุ่นใหม่ (device_index.py)
+CHECK_INTERVAL = float(os.getenv("CATALOG_CHECK_INTERVAL", "60"))  # ถาม Supabase ซ้ำได้ทุกกี่วินาที
+
+
+class CatalogVersion:
+    def __init__(self, supabase, interval=CHECK_INTERVAL):
+        self.supabase = supabase
+        self.interval = interval
+        self.value = ""
+        self.checked = None
+        self.lock = threading.Lock()
+
+    def fetch(self):
+        result = (self.supabase.table("product_embeddings").select("id", count="exact")
+                  .order("id", desc=True).limit(1).execute())
+        latest = result.data[0]["id"] if result.data else 0
+        return f"{latest}:{result.count}"
+
+    def __call__(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.checked is None or now - self.checked >= self.interval:
+                self.checked = now
+                try:
+                    self.value = self.fetch()
+                except Exception as e:
+                    # ถามไม่ได้ชั่วคราว ใช้ค่าเดิมไปก่อน (ไม่ล้างแคชทิ้งเพราะ network สะดุด)
+                    print(f"⚠️ อ่านเวอร์ชันของ catalog จาก Supabase ไม่ได้ ({e})")
+            return self.value
+
+
+_versions = {}
+_lock = threading.Lock()
+
+
+def current(supabase):
+    # เวอร์ชันล่าสุดของ catalog (แคชไว้ CHECK_INTERVAL วินาที ต่อ client)
+    with _lock:
+        version = _versions.get(id(supabase))
+        if version is None:
+            version = _versions[id(supabase)] = CatalogVersion(supabase)
+    return version()
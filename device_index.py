@@ -0,0 +1,199 @@
+import os
+import re
+import json
+import time
+import threading
+
+# ดัชนีชื่อรุ่นมือถือ (brand + model) -> สินค้าของรุ่นนั้น
+# ถ้าคำถามมีชื่อรุ่นที่รู้จัก ดึงสินค้าจากดัชนีได้เลยโดยไม่ต้อง embed / vector search
+# build_brain.py เขียนไฟล์นี้ใหม่ทุกครั้งที่รัน ถ้าเครื่องนี้ไม่มีไฟล์ (deploy แยกจากเครื่องที่รัน build_brain.py)
+# จะสร้างจากตาราง product_embeddings ใน Supabase แทน
+INDEX_PATH = os.getenv("DEVICE_INDEX_PATH", ".device_index.json")
+MAX_RESULTS = 10
+BOOTSTRAP_RETRY = 300  # สร้างจาก Supabase ไม่สำเร็จ รอกี่วินาทีก่อนลองใหม่
+
+# คำไทย / คำย่อ ที่ลูกค้าชอบพิมพ์ -> คำมาตรฐาน
+SYNONYMS = {
+    "ไอโฟน": "iphone", "ไอโฟว": "iphone", "ip": "iphone",
+    "ซัมซุง": "samsung", "ซำซุง": "samsung", "ซัมซง": "samsung",
+    "กาแล็คซี่": "galaxy", "กาแลคซี่": "galaxy", "กาแลคซี": "galaxy",
+    "เสี่ยวมี่": "xiaomi", "เรดมี่": "redmi", "ออปโป้": "oppo", "ออปโป": "oppo",
+    "วีโว่": "vivo", "หัวเว่ย": "huawei", "โนเกีย": "nokia",
+    "โปร": "pro", "แม็กซ์": "max", "แมกซ์": "max", "แม็ก": "max", "แมก": "max",
+    "พลัส": "plus", "อัลตร้า": "ultra", "อัลตรา": "ultra", "มินิ": "mini",
+    "promax": "pro max",
+}
+# คำนำหน้าตระกูลรุ่นที่ลูกค้ามักไม่พิมพ์ (Galaxy S24 -> S24)
+OPTIONAL_PREFIXES = ("galaxy",)
+
+
+def normalize(text):
+    text = (text or "").lower()
+    # แยกคำไทยที่รู้จักออกจากข้อความที่พิมพ์ติดกัน (เช่น "ไอโฟน15โปรแม็กซ์")
+    for word in sorted((w for w in SYNONYMS if not w.isascii()), key=len, reverse=True):
+        text = text.replace(word, f" {SYNONYMS[word]} ")
+    text = re.sub(r"[^\w\s\u0E00-\u0E7F]", " ", text)
+    # แยกตัวอักษรกับตัวเลขที่ติดกัน: iphone15 -> iphone 15, s24ultra -> s24 ultra (แต่ s24 คงเดิม)
+    text = re.sub(r"([a-z]{2,})(\d)", r"\1 \2", text)
+    text = re.sub(r"(\d)([a-z]{2,})", r"\1 \2", text)
+    tokens = []
+    for token in text.split():
+        tokens.extend(SYNONYMS.get(token, token).split())
+    return tokens
+
+
+def device_key(brand, model):
+    # key ของรุ่นในดัชนี (build_brain.py เก็บไว้ใน metadata["device"] ด้วย ใช้กรองตอนค้นหา)
+    return " ".join(normalize(f"{brand} {model}"))
+
+
+def device_aliases(brand, model):
+    # ชื่อเรียกที่เป็นไปได้ของรุ่นเดียวกัน
+    model_tokens = normalize(model)
+    aliases = {tuple(model_tokens), tuple(normalize(brand) + model_tokens)}
+    if model_tokens and model_tokens[0] in OPTIONAL_PREFIXES and len(model_tokens) > 1:
+        aliases.add(tuple(model_tokens[1:]))
+        aliases.add(tuple(normalize(brand) + model_tokens[1:]))
+    return {a for a in aliases if a}
+
+
+def index_data(entries):
+    # entries: list ของ {"brand", "model", "content", "metadata"} (หนึ่งรายการต่อสินค้า)
+    # ถ้ามี "device" (key ที่ build_brain.py เก็บไว้ใน metadata) ใช้เป็น key ของรุ่นเลย
+    devices = {}
+    aliases = {}
+    for entry in entries:
+        key = entry.get("device") or device_key(entry["brand"], entry["model"])
+        if not key:
+            continue
+        devices.setdefault(key, []).append({"content": entry["content"], "metadata": entry["metadata"]})
+        aliases[key] = key
+        for alias in device_aliases(entry["brand"], entry["model"]):
+            aliases[" ".join(alias)] = key
+    return {"aliases": aliases, "devices": devices}
+
+
+def build_index(entries, path=INDEX_PATH, version=None):
+    # version: เวอร์ชันของ catalog (catalog_version.current) ตอนที่สร้าง ใช้ตรวจว่าดัชนีเก่าหรือยัง
+    data = index_data(entries)
+    if version is not None:
+        data["version"] = version
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+    return len(data["devices"])
+
+
+def build_from_supabase(supabase, path=INDEX_PATH, version=None):
+    # สร้างดัชนีจาก product_embeddings (content + metadata ที่ build_brain.py เขียนไว้ ไม่ดึง embedding)
+    from vector_index import iter_pages
+
+    def entries():
+        pages = iter_pages(lambda: supabase.table("product_embeddings").select("id, content, metadata"))
+        for page in pages:
+            for row in page:
+                meta = row.get("metadata") or {}
+                if meta.get("model"):
+                    yield {"brand": meta.get("brand", ""), "model": meta["model"], "device": meta.get("device"),
+                           "content": row["content"], "metadata": meta}
+
+    return build_index(entries(), path, version)
+
+
+class DeviceIndex:
+    def __init__(self, data):
+        self.devices = data["devices"]
+        self.version = data.get("version")
+        # trie ของ token: {token: {token: ..., "$": device_key}}
+        self.trie = {}
+        for alias, key in data["aliases"].items():
+            node = self.trie
+            for token in alias.split():
+                node = node.setdefault(token, {})
+            node["$"] = key
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def find_devices(self, text):
+        # หาชื่อรุ่นที่ยาวที่สุดในแต่ละตำแหน่งของคำถาม
+        tokens = normalize(text)
+        found = []
+        i = 0
+        while i < len(tokens):
+            node, best, best_end = self.trie, None, i
+            for j in range(i, len(tokens)):
+                node = node.get(tokens[j])
+                if node is None:
+                    break
+                if "$" in node:
+                    best, best_end = node["$"], j + 1
+            if best:
+                # ถ้าตามด้วยคำบอกรุ่นย่อย แปลว่าเป็นรุ่นอื่นที่ไม่มีในดัชนี (เช่น "iphone 15 pro") ไม่นับว่าเจอ
+                if best_end < len(tokens) and tokens[best_end] in ("pro", "max", "plus", "ultra", "mini", "lite", "fe"):
+                    i = best_end
+                    continue
+                if best not in found:
+                    found.append(best)
+                i = best_end
+            else:
+                i += 1
+        return found
+
+    def lookup(self, text, limit=MAX_RESULTS):
+        products = []
+        for key in self.find_devices(text):
+            products.extend(dict(item, similarity=1.0) for item in self.devices[key])
+        return products[:limit]
+
+
+_index = None
+_index_mtime = None
+_bootstrap_failed_at = None
+_lock = threading.Lock()
+
+
+def get_index(path=INDEX_PATH, supabase=None):
+    # โหลดดัชนี (และโหลดใหม่เมื่อ build_brain.py เขียนไฟล์ใหม่)
+    # ส่ง supabase มา: ยังไม่มีไฟล์ หรือดัชนีที่สร้างจาก Supabase เก่ากว่า catalog ปัจจุบัน -> สร้างจาก Supabase ใหม่
+    global _index, _index_mtime, _bootstrap_failed_at
+    with _lock:
+        version = None
+        if supabase is not None:
+            from catalog_version import current
+            version = current(supabase)
+        if os.path.exists(path):
+            mtime = os.path.getmtime(path)
+            if _index is None or mtime != _index_mtime:
+                _index = DeviceIndex.load(path)
+                _index_mtime = mtime
+            # ไฟล์จาก build_brain.py ไม่มี version (build_brain.py เขียนใหม่เองทุกครั้งที่รัน)
+            if version is None or _index.version is None or _index.version == version:
+                return _index
+        elif supabase is None:
+            return None
+
+        if _bootstrap_failed_at is not None and time.monotonic() - _bootstrap_failed_at < BOOTSTRAP_RETRY:
+            return _index if os.path.exists(path) else None
+        print("📥 กำลังสร้างดัชนีชื่อรุ่นจาก Supabase...")
+        try:
+            build_from_supabase(supabase, path, version)
+        except Exception as e:
+            # ดัชนีเป็นทางลัด สร้างไม่ได้ก็ใช้ของเดิม / vector search ไปก่อน
+            print(f"⚠️ สร้างดัชนีชื่อรุ่นจาก Supabase ไม่สำเร็จ ({e})")
+            _bootstrap_failed_at = time.monotonic()
+            return _index if os.path.exists(path) else None
+        _bootstrap_failed_at = None
+        _index = DeviceIndex.load(path)
+        _index_mtime = os.path.getmtime(path)
+        return _index
+
+
+def lookup_products(text, supabase=None):
+    # คืน list ของสินค้าถ้าคำถามระบุรุ่นที่รู้จัก ไม่งั้นคืน None (ให้ไปใช้ vector search แทน)
+    index = get_index(supabase=supabase)
+    if index is None:
+        return None
+    return index.lookup(text) or None
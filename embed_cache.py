@@ -0,0 +1,130 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+import google.generativeai as genai
+from scheduler import scheduler
+from metrics import metrics
+
+# แคช embedding ของคำถามลูกค้า (ข้อความเดิม -> vector เดิม ไม่ต้องเรียก API ซ้ำ)
+# ชั้นที่ 1: LRU ในหน่วยความจำ  ชั้นที่ 2: SQLite บนดิสก์ (อยู่รอดหลัง restart)
+EMBED_MODEL = "models/text-embedding-004"
+CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "2000"))
+CACHE_PATH = os.getenv("EMBED_CACHE_PATH", ".embed_cache.sqlite")
+DISK_SIZE = int(os.getenv("EMBED_CACHE_DISK_SIZE", "50000"))
+
+
+def normalize_query(text):
+    # รวมช่องว่าง / ตัวพิมพ์เล็กใหญ่ ให้คำถามเดียวกันได้ key เดียวกัน
+    text = unicodedata.normalize("NFC", text or "")
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class EmbeddingCache:
+    def __init__(self, max_items=CACHE_SIZE, path=CACHE_PATH, disk_items=DISK_SIZE):
+        self.max_items = max_items
+        self.disk_items = disk_items
+        self.writes = 0
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB, last_used REAL)")
+            # ไฟล์แคชจากเวอร์ชันก่อนยังไม่มีคอลัมน์ last_used
+            columns = [row[1] for row in self.db.execute("PRAGMA table_info(embeddings)")]
+            if "last_used" not in columns:
+                self.db.execute("ALTER TABLE embeddings ADD COLUMN last_used REAL DEFAULT 0")
+            self.db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self.db.commit()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key]
+
+            if self.db is not None:
+                row = self.db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row:
+                    vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+                    # อัปเดตเวลาที่ใช้ล่าสุด (ตัดแถวทิ้งตามเวลานี้ = LRU)
+                    self.db.execute("UPDATE embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+                    self.db.commit()
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def put(self, key, vector):
+        with self.lock:
+            self._remember(key, vector)
+            if self.db is not None:
+                blob = np.asarray(vector, dtype=np.float32).tobytes()
+                now = time.time()
+                self.db.execute("INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", (key, blob, now))
+                self.writes += 1
+                # ตัดแถวที่ไม่ได้ใช้นานที่สุดทิ้งเป็นระยะ ไม่ให้ไฟล์โตไม่จำกัด
+                if self.writes % 100 == 0:
+                    # ตัวที่ยังอยู่ในหน่วยความจำ (hit จาก memory ไม่ได้แตะดิสก์) นับว่าเพิ่งใช้
+                    self.db.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", ((now, k) for k in self.memory))
+                    self.db.execute(
+                        "DELETE FROM embeddings WHERE key NOT IN (SELECT key FROM embeddings ORDER BY last_used DESC LIMIT ?)",
+                        (self.disk_items,)
+                    )
+                self.db.commit()
+
+    def _remember(self, key, vector):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "size": len(self.memory),
+            "hit_rate": (self.hits + self.disk_hits) / total if total else 0.0,
+        }
+
+
+_cache = EmbeddingCache()
+
+
+def embed_query(text, model=EMBED_MODEL):
+    # ใช้แทน genai.embed_content(...)['embedding'] สำหรับคำถามลูกค้า
+    # ข้อความที่ normalize แล้วใช้เป็น key ของแคชเท่านั้น ส่งข้อความเดิมของลูกค้าไป embed
+    key = f"{model}:{normalize_query(text)}"
+
+    vector = _cache.get(key)
+    if vector is None:
+        # ผ่าน scheduler: คำถามเดียวกันที่ถามพร้อมกันหลาย session ยิง API ครั้งเดียว
+        vector = scheduler.run(
+            "embed",
+            lambda name: genai.embed_content(model=name, content=text)['embedding'],
+            [model],
+            key=("embed", key),
+        )
+        _cache.put(key, vector)
+    return vector
+
+
+def cache_stats():
+    return _cache.stats()
+
+
+metrics.register("embed_cache", cache_stats)
@@ -1,8 +1,16 @@
 import os
-import time
+import re
+import json
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import google.generativeai as genai
 from supabase import create_client, Client
 from dotenv import load_dotenv
+from embed_cache import cache_stats
+from pipeline import live_pipeline
+from model_resolver import ResolvedModel
+from scheduler import GENERATE_RPM
 
 # 1. โหลด Key
 load_dotenv()
@@ -13,62 +21,66 @@ SUPA_KEY = os.getenv("SUPABASE_KEY")
 genai.configure(api_key=GEMINI_KEY)
 supabase: Client = create_client(SUPA_URL, SUPA_KEY)
 
-# เลือกโมเดล (Flash)
-model = genai.GenerativeModel('gemini-1.5-flash')
-
-# --- 2. ชุดข้อสอบ (แก้โจทย์ตรงนี้ได้ตามใจชอบ) ---
-test_cases = [
-    {
-        "question": "สวัสดีครับ", 
-        "expected_concept": "ทักทาย / ถามรุ่นมือถือ"
-    },
-    {
-        "question": "มีฟิล์ม iPhone 15 Pro Max ไหม", 
-        "expected_concept": "มีของ / แนะนำสินค้า / ขอประเภท"
-    },
-    {
-        "question": "ขอแบบกันมอง iPhone 14", 
-        "expected_concept": "Focus Privacy / กันมอง / iPhone 14"
-    },
-    {
-        "question": "Samsung S24 Ultra ราคาเท่าไหร่", 
-        "expected_concept": "ราคา / บาท / S24 Ultra"
-    },
-    {
-        "question": "มีฟิล์มรุ่น Nokia 3310 ไหม", 
-        "expected_concept": "ไม่มีของ / ขออภัย"
-    }
-]
+# เลือกโมเดล (Flash) ใช้ผลที่แคชไว้ หรือระบุเองด้วย GEMINI_MODEL
+model = ResolvedModel()
 
-# --- 3. ฟังก์ชันให้น้องโฟกัสตอบ (จำลองการทำงาน) ---
-def get_bot_response(user_q):
-    try:
-        # Search
-        vec = genai.embed_content(model="models/text-embedding-004", content=user_q)['embedding']
-        res = supabase.rpc("match_products", {"query_embedding": vec, "match_threshold": 0.35, "match_count": 3}).execute()
-        
-        context = ""
-        if res.data:
-            for item in res.data:
-                meta = item['metadata']
-                context += f"- {item['content']} (ราคา: {meta.get('price')} Link: {meta.get('link')})\n"
-        else:
-            context = "ไม่พบข้อมูลสินค้า"
+# --- 2. ชุดข้อสอบ (แก้โจทย์ได้ในไฟล์ eval_cases.jsonl บรรทัดละ 1 ข้อ) ---
+def load_test_cases(path):
+    cases = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                cases.append(json.loads(line))
+    return cases
 
-        # Prompt
-        prompt = f"""
+# --- 3. ฟังก์ชันให้น้องโฟกัสตอบ (จำลองการทำงาน) ---
+def eval_prompt(user_q, context, history_text):
+    return f"""
         คุณคือแอดมินขายฟิล์ม Focus Shield
         [ข้อมูลอ้างอิง] {context}
         [คำถาม] {user_q}
         ให้ตอบคำถามลูกค้า ถ้ามีของให้บอกราคาและลิงก์ ถ้าไม่มีให้บอกตรงๆ
         """
-        response = model.generate_content(prompt)
-        return response.text
+
+# ค้นหา / กรอง / router ชุดเดียวกับ app.py ต่างแค่จำนวนสินค้าใน context และ prompt ของข้อสอบ
+bot = live_pipeline(supabase, model, match_count=3, prompt_builder=eval_prompt)
+
+def get_bot_response(user_q):
+    try:
+        return bot.answer(user_q, "")
     except:
         return "Error"
 
 # --- 4. ฟังก์ชันครูตรวจข้อสอบ (Judge) ---
+# ตรวจทีละหลายข้อในคำขอเดียว (JUDGE_BATCH ข้อ) และจำผลตรวจไว้ในดิสก์
+# ข้อที่คำถาม / คำตอบ / สิ่งที่คาดหวัง เหมือนเดิม ไม่ต้องตรวจซ้ำ (เปลี่ยน JUDGE_VERSION เมื่อแก้เกณฑ์ตรวจ)
+JUDGE_CACHE_PATH = os.getenv("JUDGE_CACHE_PATH", ".judge_cache.json")
+JUDGE_BATCH = int(os.getenv("JUDGE_BATCH", "10"))
+JUDGE_VERSION = "1"
+VERDICT = re.compile(r'"?(\d+)"?\s*[:=.)-]\s*"?(YES|NO)\b', re.IGNORECASE)
+
+def judge_key(question, answer, expected):
+    raw = json.dumps([JUDGE_VERSION, question, answer, expected], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def load_judge_cache(path=JUDGE_CACHE_PATH):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_judge_cache(cache, path=JUDGE_CACHE_PATH):
+    try:
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+
 def evaluate_answer(question, answer, expected):
+    # ตรวจข้อเดียว คืน True / False หรือ None ถ้าเรียกโมเดลไม่สำเร็จ (ไม่เก็บลงแคช)
     judge_prompt = f"""
     บทบาท: คุณคือครูตรวจข้อสอบ
     
@@ -89,35 +101,125 @@ def evaluate_answer(question, answer, expected):
         res = model.generate_content(judge_prompt)
         return "YES" in res.text.strip().upper()
     except:
-        return False
+        return None
 
-# --- 5. เริ่มสอบ ---
-print(f"📝 เริ่มการสอบวัดผล (จำนวน {len(test_cases)} ข้อ)...\n")
-score = 0
+def parse_verdicts(text, count):
+    # รับได้ทั้ง {"1": "YES", ...} และบรรทัด "1: YES" คืน {ลำดับข้อ: True/False} เฉพาะข้อที่อ่านได้
+    verdicts = {}
+    for number, verdict in VERDICT.findall(text or ""):
+        index = int(number) - 1
+        if 0 <= index < count and index not in verdicts:
+            verdicts[index] = verdict.upper() == "YES"
+    return verdicts
 
-for i, case in enumerate(test_cases):
-    q = case["question"]
-    expect = case["expected_concept"]
-    
-    print(f"ข้อที่ {i+1}: {q}")
-    
-    # ให้น้องตอบ
-    bot_ans = get_bot_response(q)
-    # ให้ครูตรวจ
-    is_correct = evaluate_answer(q, bot_ans, expect)
+def evaluate_batch(items):
+    # items = [(question, answer, expected)] ตรวจรวดเดียว คืน {ลำดับ: True/False} (ข้อที่อ่านผลไม่ได้จะไม่มีใน dict)
+    blocks = "\n".join(
+        f"""
+    ข้อ {i + 1}
+    โจทย์: "{question}"
+    สิ่งที่คาดหวัง (Key Concept): "{expected}"
+    คำตอบของ AI: "{answer}"
+    """ for i, (question, answer, expected) in enumerate(items))
+    judge_prompt = f"""
+    บทบาท: คุณคือครูตรวจข้อสอบ ตรวจ {len(items)} ข้อต่อไปนี้แยกกันทีละข้อ
+    {blocks}
+    ภารกิจ:
+    คำตอบของ AI แต่ละข้อ "สื่อความหมายถูกต้อง" ตามสิ่งที่คาดหวังของข้อนั้นหรือไม่?
+    (ไม่จำเป็นต้องคำพูดเป๊ะๆ ขอแค่ใจความได้)
     
-    if is_correct:
-        score += 1
-        print(f"✅ ผ่าน! (บอทตอบ: {bot_ans[:50]}...)")
-    else:
-        print(f"❌ ไม่ผ่าน")
-        print(f"   - คาดหวัง: {expect}")
-        print(f"   - บอทตอบ: {bot_ans}")
+    - ถ้าถูกต้อง/ตรงประเด็น: YES
+    - ถ้าผิด/มั่ว/ไม่ตรงคำถาม: NO
     
-    print("-" * 30)
-    time.sleep(1) # พักนิดนึง
+    ตอบเป็น JSON อย่างเดียว ครบทุกข้อ เช่น {{"1": "YES", "2": "NO"}}
+    """
+    try:
+        res = model.generate_content(judge_prompt)
+        return parse_verdicts(res.text, len(items))
+    except:
+        return {}
+
+class Judge:
+    def __init__(self, batch_size=JUDGE_BATCH, cache_path=JUDGE_CACHE_PATH):
+        self.batch_size = max(1, batch_size)
+        self.cache_path = cache_path
+        self.cache = load_judge_cache(cache_path) if cache_path else {}
+        self.stats = {"cached": 0, "batch_calls": 0, "single_calls": 0, "failed": 0}
+
+    def grade(self, items, pool):
+        # items = [(question, answer, expected)] คืน [True/False] ตามลำดับเดิม
+        keys = [judge_key(*item) for item in items]
+        results = [self.cache.get(key) for key in keys]
+        todo = [i for i, verdict in enumerate(results) if verdict is None]
+        self.stats["cached"] += len(items) - len(todo)
+
+        if self.batch_size > 1:
+            batches = [todo[i:i + self.batch_size] for i in range(0, len(todo), self.batch_size)]
+            self.stats["batch_calls"] += len(batches)
+            for batch, verdicts in zip(batches, pool.map(lambda b: evaluate_batch([items[i] for i in b]), batches)):
+                for position, verdict in verdicts.items():
+                    results[batch[position]] = verdict
+            # ข้อที่อ่านผลจากคำขอรวมไม่ได้ ตรวจทีละข้อแทน
+            todo = [i for i in todo if results[i] is None]
+
+        self.stats["single_calls"] += len(todo)
+        for i, verdict in zip(todo, pool.map(lambda i: evaluate_answer(*items[i]), todo)):
+            results[i] = verdict
+
+        for key, verdict in zip(keys, results):
+            if verdict is None:
+                self.stats["failed"] += 1
+            else:
+                self.cache[key] = verdict
+        if self.cache_path:
+            save_judge_cache(self.cache, self.cache_path)
+        return [bool(verdict) for verdict in results]
+
+# --- 5. เริ่มสอบ ---
+def parse_args():
+    parser = argparse.ArgumentParser(description="สอบวัดผลน้องโฟกัส")
+    parser.add_argument("--cases", default="eval_cases.jsonl", help="ไฟล์ข้อสอบ (JSONL: question, expected_concept)")
+    parser.add_argument("--workers", type=int, default=4, help="จำนวนข้อที่สอบพร้อมกัน")
+    parser.add_argument("--judge-batch", type=int, default=JUDGE_BATCH, help="จำนวนข้อที่ครูตรวจต่อ 1 คำขอ (1 = ตรวจทีละข้อ)")
+    parser.add_argument("--no-judge-cache", action="store_true", help="ตรวจใหม่ทุกข้อ ไม่ใช้ / ไม่บันทึกผลตรวจเดิม")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    test_cases = load_test_cases(args.cases)
+    print(f"📝 เริ่มการสอบวัดผล (จำนวน {len(test_cases)} ข้อ, {args.workers} workers, {GENERATE_RPM} req/min)...\n")
+    score = 0
+
+    judge = Judge(args.judge_batch, None if args.no_judge_cache else JUDGE_CACHE_PATH)
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        # ให้น้องตอบทุกข้อก่อน (map() คืนผลตามลำดับข้อเดิม) แล้วค่อยให้ครูตรวจรวดเดียว
+        answers = list(pool.map(lambda case: get_bot_response(case["question"]), test_cases))
+        verdicts = judge.grade([(case["question"], ans, case["expected_concept"]) for case, ans in zip(test_cases, answers)], pool)
+
+    for i, (case, bot_ans, is_correct) in enumerate(zip(test_cases, answers, verdicts)):
+        q = case["question"]
+        expect = case["expected_concept"]
+
+        print(f"ข้อที่ {i+1}: {q}")
+
+        if is_correct:
+            score += 1
+            print(f"✅ ผ่าน! (บอทตอบ: {bot_ans[:50]}...)")
+        else:
+            print(f"❌ ไม่ผ่าน")
+            print(f"   - คาดหวัง: {expect}")
+            print(f"   - บอทตอบ: {bot_ans}")
+
+        print("-" * 30)
+
+    # สรุปผล
+    accuracy = (score / len(test_cases)) * 100 if test_cases else 0
+    print(f"\n🎯 ผลการสอบ: ได้คะแนน {score}/{len(test_cases)}")
+    print(f"📊 ความแม่นยำ (Accuracy): {accuracy:.2f}%")
+
+    j = judge.stats
+    print(f"🧑‍🏫 Judge: ใช้ผลเดิม {j['cached']} ข้อ | ตรวจรวด {j['batch_calls']} คำขอ | ตรวจทีละข้อ {j['single_calls']} คำขอ"
+          + (f" | ตรวจไม่สำเร็จ {j['failed']} ข้อ" if j["failed"] else ""))
 
-# สรุปผล
-accuracy = (score / len(test_cases)) * 100
-print(f"\n🎯 ผลการสอบ: ได้คะแนน {score}/{len(test_cases)}")
-print(f"📊 ความแม่นยำ (Accuracy): {accuracy:.2f}%")
\ No newline at end of file
+    stats = cache_stats()
+    print(f"📈 Embedding cache: hit rate {stats['hit_rate']:.0%} ({stats['hits'] + stats['disk_hits']} hit / {stats['misses']} miss)")
@@ -0,0 +1,150 @@
+import re
+import time
+import hashlib
+import numpy as np
+from vector_index import VectorIndex
+from device_index import DeviceIndex, index_data, device_key
+from query_filters import brand_key, film_type
+
+# ตัวจำลอง Gemini / Supabase สำหรับ benchmark และ load test (ไม่ต้องต่อเน็ต)
+# ทุกตัวหน่วงเวลาแบบ log-normal รอบค่ากลางที่กำหนด ให้ใกล้เคียงเวลาจริงของ API
+
+
+class Latency:
+    def __init__(self, median_ms, sigma=0.25, seed=None):
+        self.median = median_ms / 1000.0
+        self.sigma = sigma
+        self.rng = np.random.default_rng(seed)
+
+    def sample(self):
+        if self.median <= 0:
+            return 0.0
+        return float(self.median * np.exp(self.rng.normal(0.0, self.sigma)))
+
+    def sleep(self):
+        delay = self.sample()
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+def _token_vector(token, dim):
+    seed = int.from_bytes(hashlib.sha256(token.encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+
+
+def _features(text):
+    # คำ + ตัวอักษร 3 ตัวติดกันของแต่ละคำ (ภาษาไทยไม่เว้นวรรค จึงต้องใช้ n-gram ช่วย)
+    words = re.findall(r"[\w\u0E00-\u0E7F]+", (text or "").lower())
+    features = list(words)
+    for word in words:
+        features.extend(word[i:i + 3] for i in range(len(word) - 2))
+    return features or [""]
+
+
+class FakeEmbedder:
+    # embedding แบบ bag-of-words: ข้อความที่มีคำเหมือนกันได้ vector ใกล้กัน ผลลัพธ์คงที่ทุกครั้ง
+    def __init__(self, dim=768, latency_ms=80, sigma=0.25, seed=None):
+        self.dim = dim
+        self.latency = Latency(latency_ms, sigma, seed)
+        self.calls = 0
+
+    def vector(self, text):
+        vec = np.sum([_token_vector(t, self.dim) for t in _features(text)], axis=0)
+        return (vec / (np.linalg.norm(vec) or 1.0)).tolist()
+
+    def __call__(self, text):
+        self.calls += 1
+        self.latency.sleep()
+        return self.vector(text)
+
+
+BRANDS = {
+    "Apple": ["iPhone 13", "iPhone 14", "iPhone 14 Pro Max", "iPhone 15", "iPhone 15 Pro Max"],
+    "Samsung": ["Galaxy S23", "Galaxy S24", "Galaxy S24 Ultra", "Galaxy A55"],
+    "Xiaomi": ["Redmi Note 13", "Xiaomi 14"],
+    "OPPO": ["Reno 11", "Find X7"],
+}
+FILM_TYPES = [("ฟิล์มใส", 290), ("ฟิล์มด้าน", 320), ("ฟิล์มกันมอง", 390)]
+
+
+def synthetic_catalog(size=None):
+    # สร้าง catalog จำลองรูปแบบเดียวกับที่ build_brain.py เขียนลง product_embeddings
+    items = []
+    for brand, models in BRANDS.items():
+        for model in models:
+            for film, price in FILM_TYPES:
+                pid = str(len(items) + 1)
+                items.append({
+                    "id": pid,
+                    "content": f"สินค้า: {brand} {model} ประเภท: {film} ราคา: {price}",
+                    "metadata": {
+                        "product_id": pid, "model": model, "price": price, "link": f"https://example.com/p/{pid}",
+                        "brand": brand_key(brand), "device": device_key(brand, model), "film_type": film_type(film),
+                    },
+                })
+    if size:
+        # ขยายให้ได้ขนาดที่ต้องการ (ใช้ทดสอบ catalog ใหญ่)
+        base = list(items)
+        while len(items) < size:
+            src = base[len(items) % len(base)]
+            pid = str(len(items) + 1)
+            items.append({
+                "id": pid,
+                "content": f"{src['content']} #{pid}",
+                "metadata": dict(src["metadata"], product_id=pid),
+            })
+        items = items[:size]
+    return items
+
+
+class FakeVectorStore:
+    # จำลอง RPC match_products: หน่วงเวลาเท่า network round trip แล้วค้นใน numpy
+    def __init__(self, embedder, catalog=None, latency_ms=60, sigma=0.3, seed=None):
+        self.items = catalog or synthetic_catalog()
+        self.index = VectorIndex.from_arrays([embedder.vector(i["content"]) for i in self.items], self.items)
+        self.latency = Latency(latency_ms, sigma, seed)
+        self.calls = 0
+
+    def __call__(self, query_embedding, match_threshold=0.35, match_count=5, filters=None):
+        self.calls += 1
+        self.latency.sleep()
+        return self.index.search(query_embedding, match_threshold, match_count, filters)
+
+
+def fake_device_index(catalog):
+    # ดัชนีชื่อรุ่นจาก catalog จำลอง (ไม่มีหน่วงเวลา เพราะของจริงก็อยู่ในหน่วยความจำ)
+    return DeviceIndex(index_data([
+        {"brand": i["metadata"]["brand"], "model": i["metadata"]["model"], "device": i["metadata"]["device"],
+         "content": i["content"], "metadata": i["metadata"]}
+        for i in catalog
+    ]))
+
+
+class FakeGenerator:
+    # จำลอง generate_content: รอ time-to-first-token แล้วค่อยๆ ปล่อย token ตามความเร็วที่กำหนด
+    def __init__(self, first_token_ms=400, tokens_per_sec=60, reply_tokens=60, sigma=0.3, seed=None):
+        self.first_token = Latency(first_token_ms, sigma, seed)
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_tokens = reply_tokens
+        self.calls = 0
+
+    def _reply(self, prompt):
+        return [f"คำตอบ{i} " for i in range(self.reply_tokens)]
+
+    def _stream(self, tokens, chunk_size=8):
+        self.first_token.sleep()
+        for i in range(0, len(tokens), chunk_size):
+            chunk = tokens[i:i + chunk_size]
+            if i:
+                time.sleep(len(chunk) / self.tokens_per_sec)
+            yield "".join(chunk)
+
+    def __call__(self, prompt, stream=False):
+        self.calls += 1
+        tokens = self._reply(prompt)
+        if stream:
+            return self._stream(tokens)
+        self.first_token.sleep()
+        time.sleep(len(tokens) / self.tokens_per_sec)
+        return "".join(tokens)
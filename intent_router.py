@@ -0,0 +1,132 @@
+import os
+import re
+import json
+import time
+import threading
+from collections import Counter
+from metrics import metrics
+
+# ตัวคัดกรองข้อความก่อนถึง LLM: คำทักทาย / ขอบคุณ / ลา ตอบจาก template ได้เลย
+# และถ้าลูกค้าถามหารุ่นที่ค้นไม่เจอในคลัง ก็ตอบ "ไม่มีของ" โดยไม่ต้อง generate
+ROUTE_LOG_PATH = os.getenv("ROUTE_LOG_PATH", ".route_log.jsonl")
+# ไฟล์ log ใหญ่เกินนี้ ย้ายไปเป็น .1 (เก็บไว้ไฟล์เดียว) แล้วเริ่มไฟล์ใหม่
+ROUTE_LOG_MAX_BYTES = int(os.getenv("ROUTE_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+
+# คำลงท้าย / คำเสริม ที่ตัดทิ้งก่อนจับ intent
+FILLERS = r"(ครับ|คับ|ค่ะ|คะ|ค้า|จ้า|จ้ะ|นะ|น้า|ฮะ|แอดมิน|แอด|น้องโฟกัส|น้อง|\badmin\b|\bna\b|\bkrub\b|\bka\b)"
+
+# เรียงตามความสำคัญ: ถ้าข้อความมีหลาย intent ปนกัน (เช่น "ok ขอบคุณครับ") ใช้ตัวแรกที่เจอ
+SMALL_TALK = {
+    "goodbye": r"(บาย|ลาก่อน|แล้วเจอกัน|bye|goodbye)",
+    "thanks": r"(ขอบคุณ(มาก)?|ขอบใจ|thank(s| you)?|thx|ty)",
+    "greeting": r"(สวัสดี|หวัดดี|hello|hi|hey|hallo)",
+    "ack": r"(โอเค|ok|okay|ได้เลย|รับทราบ|ตกลง)",
+}
+
+TEMPLATES = {
+    "greeting": "สวัสดีค่ะ! น้องโฟกัสยินดีให้บริการ กำลังมองหาฟิล์มสำหรับมือถือรุ่นไหนอยู่คะ? 😊",
+    "thanks": "ยินดีเสมอเลยค่ะ 🙏 ถ้ามีรุ่นไหนอยากได้ฟิล์มเพิ่ม ทักน้องโฟกัสได้ตลอดนะคะ 😊",
+    "goodbye": "ขอบคุณที่แวะมานะคะ แล้วเจอกันใหม่ค่ะ 👋🛡️",
+    "ack": "รับทราบค่ะ 😊 ถ้าอยากดูฟิล์มรุ่นไหนเพิ่ม บอกน้องโฟกัสได้เลยนะคะ",
+    "no_stock": "ขออภัยค่ะ 🙏 ตอนนี้ยังไม่มีฟิล์มสำหรับรุ่นนี้ในคลังเลยค่ะ ลองบอกรุ่นมือถืออื่น หรือเช็คชื่อรุ่นอีกครั้งได้นะคะ 😊",
+}
+
+# intent ที่ความหมายขึ้นกับบทสนทนา (เช่น "ตกลงค่ะ" ตอบรับข้อเสนอ ต้องได้ราคา + ลิงก์) ตอบจาก template เฉพาะตอนยังไม่มีประวัติ
+NEEDS_CONTEXT = ("ack",)
+
+# ชื่อแบรนด์ / คำที่บอกว่าลูกค้ากำลังถามหารุ่นมือถือ
+DEVICE_HINTS = r"(iphone|ไอโฟน|samsung|ซัมซุง|galaxy|xiaomi|redmi|เสี่ยวมี่|oppo|vivo|realme|huawei|honor|nokia|โนเกีย|pixel|oneplus|infinix|tecno|รุ่น)"
+# ชื่อรุ่นแบบตัวอักษร + ตัวเลขติดกัน (s24, a54, x100) เว้นวรรคไม่นับ ("film 2", "anti glare 2 ชิ้น")
+MODEL_TOKEN = r"(?<![a-z0-9])[a-z]+\d+[a-z]*"
+# ตัวเลขที่เป็นราคา / งบ ไม่ใช่ชื่อรุ่น
+PRICE_NUMBER = r"((งบ|ราคา|ไม่เกิน|ต่ำกว่า|budget|under)\s*\d[\d,.]*|\d[\d,.]*\s*(บาท|฿|baht|thb))"
+
+
+def _strip(text):
+    text = (text or "").lower()
+    text = re.sub(FILLERS, " ", text)
+    text = re.sub(r"[^\w\s\u0E00-\u0E7F]", " ", text)  # ตัดเครื่องหมาย / emoji (เก็บสระ/วรรณยุกต์ไทยไว้)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def classify(text):
+    # คืนชื่อ intent ถ้าข้อความเป็น small talk ล้วนๆ (ไม่มีเนื้อหาอื่นปน) ไม่งั้นคืน None
+    stripped = _strip(text)
+    if not stripped:
+        return None
+    any_small_talk = "|".join(SMALL_TALK.values())
+    if not re.fullmatch(rf"(({any_small_talk})\s*)+", stripped):
+        return None
+    for intent, pattern in SMALL_TALK.items():
+        if re.search(pattern, stripped):
+            return intent
+    return None
+
+
+def mentions_device(text):
+    # มีชื่อแบรนด์ หรือมีชื่อรุ่นแบบตัวอักษร + ตัวเลข (เช่น S24) ถือว่าถามหารุ่นมือถือ
+    # ตัวเลขลอยๆ / ราคา (เช่น "งบ 500 บาท") ไม่นับ
+    lowered = re.sub(PRICE_NUMBER, " ", (text or "").lower())
+    return bool(re.search(DEVICE_HINTS, lowered) or re.search(MODEL_TOKEN, lowered))
+
+
+class IntentRouter:
+    def __init__(self, log_path=ROUTE_LOG_PATH, log_max_bytes=ROUTE_LOG_MAX_BYTES):
+        self.log_path = log_path
+        self.log_max_bytes = log_max_bytes
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, route):
+        # นับ/บันทึกเส้นทางของแต่ละข้อความ (llm, answer_cache, greeting, no_stock, ...)
+        with self.lock:
+            self.counts[route] += 1
+            if self.log_path:
+                try:
+                    with open(self.log_path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps({"ts": round(time.time(), 3), "route": route}) + "\n")
+                        size = f.tell()
+                    if self.log_max_bytes and size > self.log_max_bytes:
+                        os.replace(self.log_path, self.log_path + ".1")
+                except OSError:
+                    pass
+
+    def before_retrieval(self, user_input, history_text=""):
+        # คืนคำตอบ template ถ้าไม่ต้องค้นหา/generate เลย
+        intent = classify(user_input)
+        if intent in NEEDS_CONTEXT and (history_text or "").strip():
+            return None
+        if intent:
+            self.record(intent)
+            return TEMPLATES[intent]
+        return None
+
+    def after_retrieval(self, user_input, results):
+        # ค้นไม่เจอสินค้าเลย และลูกค้าระบุรุ่นมา -> ตอบว่าไม่มีของ
+        # (ถ้าไม่ได้ระบุรุ่น เช่น "เอาแบบด้าน" ต้องอาศัยประวัติการคุย ปล่อยให้ LLM ตอบ)
+        if not results and mentions_device(user_input):
+            self.record("no_stock")
+            return TEMPLATES["no_stock"]
+        return None
+
+    def stats(self):
+        total = sum(self.counts.values())
+        skipped = total - self.counts["llm"]
+        return {
+            "total": total,
+            "skipped_llm": skipped,
+            "skip_rate": skipped / total if total else 0.0,
+            "routes": dict(self.counts),
+        }
+
+
+router = IntentRouter() if os.getenv("INTENT_ROUTER", "1") != "0" else None
+
+
+def route_metrics():
+    stats = router.stats()
+    return {"skip_rate": stats["skip_rate"], **{f"route_{name}": count for name, count in stats["routes"].items()}}
+
+
+if router:
+    metrics.register("router", route_metrics)
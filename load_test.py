@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from bench import add_pipeline_args, build_fake_pipeline, summarize
+from session_store import SessionStore
+from pipeline import STAGES
+
+# จำลองลูกค้าหลายคนคุยพร้อมกัน เพื่อหาว่า 1 process (1 dyno) รับได้กี่คนก่อน latency พุ่ง
+# - ลูกค้าเข้ามาแบบสุ่ม (Poisson) ตามอัตรา --rate ต่อวินาที แต่ละคนคุยหลายข้อความ เว้นช่วงคิดระหว่างข้อความ
+# - แต่ละรอบเรียก pipeline.answer / stream ตัวเดียวกับ get_focus_response ของ app.py (Gemini / Supabase ใช้ตัวจำลองใน fakes.py)
+# - thread pool ขนาด --concurrency แทนจำนวนรอบที่ process ทำได้พร้อมกัน ส่วนที่เกินต้องรอคิว
+# - รายงาน throughput, latency (p50/p95/p99), เวลารอคิว และหน่วยความจำตามช่วงเวลา
+FOLLOW_UPS = [
+    "แบบด้านราคาเท่าไหร่คะ",
+    "มีแบบกันมองไหม",
+    "งบไม่เกิน 300 บาทมีไหม",
+    "ติดตั้งเองได้ไหมคะ",
+    "ส่งกี่วันถึง",
+    "ขอบคุณค่ะ",
+]
+
+
+def synthetic_conversations(count, turns, seed=0):
+    # บทสนทนาจำลอง: ถามรุ่นก่อน แล้วถามต่อเรื่องประเภทฟิล์ม / ราคา / การส่ง
+    from fakes import BRANDS
+    rng = random.Random(seed)
+    models = [f"{brand} {model}" for brand, names in BRANDS.items() for model in names]
+    conversations = []
+    for _ in range(count):
+        opener = rng.choice(["มีฟิล์ม {} ไหมคะ", "ฟิล์ม {} ราคาเท่าไหร่", "สวัสดีค่ะ หาฟิล์มกระจก {}"]).format(rng.choice(models))
+        follow = rng.sample(FOLLOW_UPS, k=min(len(FOLLOW_UPS), max(0, rng.randint(1, turns) - 1)))
+        conversations.append([opener] + follow)
+    return conversations
+
+
+def load_conversations(path):
+    # JSONL บรรทัดละ 1 บทสนทนา: {"turns": ["...", "..."]} หรือ ["...", "..."]
+    conversations = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                turns = record["turns"] if isinstance(record, dict) else record
+                conversations.append([t["content"] if isinstance(t, dict) else t for t in turns])
+    return conversations
+
+
+def rss_bytes():
+    # หน่วยความจำที่ process ใช้อยู่ (Linux อ่านจาก /proc, ที่อื่นใช้ค่าสูงสุดแทน)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class LoadTest:
+    def __init__(self, pipeline, concurrency, store, stream=False, think_ms=2000):
+        self.pipeline = pipeline
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="load")
+        self.store = store
+        self.stream = stream
+        self.think = think_ms / 1000.0
+        self.turns = []         # timings ของทุกรอบที่จบแล้ว
+        self.errors = 0
+        self.queued = 0
+        self.in_flight = 0
+        self.active_sessions = 0
+        self.lock = threading.Lock()
+
+    def count(self, queued=0, in_flight=0):
+        with self.lock:
+            self.queued += queued
+            self.in_flight += in_flight
+
+    def run_turn(self, session, message, submitted):
+        # รันใน thread pool: เวลาตั้งแต่ส่งจนได้ thread คือเวลารอคิว
+        started = time.perf_counter()
+        self.count(queued=-1, in_flight=1)
+        timings = {}
+        try:
+            history = session.conversation.render()
+            if self.stream:
+                reply = "".join(self.pipeline.stream(message, history, timings))
+            else:
+                reply = self.pipeline.answer(message, history, timings)
+            self.store.add(session, "user", message)
+            self.store.add(session, "assistant", reply)
+        finally:
+            self.count(in_flight=-1)
+        finished = time.perf_counter()
+        timings["queue"] = started - submitted
+        timings["service"] = finished - started
+        timings["latency"] = finished - submitted
+        return timings
+
+    async def customer(self, session_id, messages, rng):
+        loop = asyncio.get_running_loop()
+        session = self.store.get(session_id)
+        self.active_sessions += 1
+        try:
+            for i, message in enumerate(messages):
+                if i:
+                    # เวลาที่ลูกค้าอ่านคำตอบ / พิมพ์ข้อความถัดไป
+                    await asyncio.sleep(rng.expovariate(1 / self.think) if self.think else 0)
+                self.count(queued=1)
+                try:
+                    self.turns.append(await loop.run_in_executor(
+                        self.executor, self.run_turn, session, message, time.perf_counter()))
+                except Exception:
+                    self.errors += 1
+        finally:
+            self.active_sessions -= 1
+
+    async def sample(self, timeline, started, interval):
+        # เก็บสถานะทุก interval วินาที (throughput / p95 ของช่วงนั้น, คิว, หน่วยความจำ)
+        seen = 0
+        while True:
+            await asyncio.sleep(interval)
+            now = time.perf_counter()
+            window = [t["latency"] for t in self.turns[seen:]]
+            seen = len(self.turns)
+            stats = self.store.stats()
+            timeline.append({
+                "t": round(now - started, 2),
+                "turns_per_sec": round(len(window) / interval, 2),
+                "p95_ms": round(float(np.percentile(window, 95)) * 1000, 1) if window else None,
+                "queued": self.queued,
+                "in_flight": self.in_flight,
+                "sessions": self.active_sessions,
+                "rss_mb": round(rss_bytes() / 1e6, 1),
+                "session_kb": round(stats["resident_bytes"] / 1e3, 1),
+            })
+
+    async def run(self, conversations, rate, interval=1.0, seed=0):
+        rng = random.Random(seed)
+        timeline = []
+        started = time.perf_counter()
+        sampler = asyncio.create_task(self.sample(timeline, started, interval))
+        customers = []
+        for i, messages in enumerate(conversations):
+            if rate > 0 and i:
+                await asyncio.sleep(rng.expovariate(rate))   # ลูกค้าเข้ามาแบบ Poisson
+            customers.append(asyncio.create_task(self.customer(f"load-{i}", messages, random.Random(rng.random()))))
+        await asyncio.gather(*customers)
+        wall = time.perf_counter() - started
+        sampler.cancel()
+        self.executor.shutdown()
+        return self.report(wall, timeline, len(conversations))
+
+    def report(self, wall, timeline, sessions):
+        metrics = {}
+        for name in ("latency", "queue", "service", "first_chunk") + STAGES:
+            samples = [t[name] for t in self.turns if name in t]
+            if samples:
+                metrics[name] = summarize(samples)
+        return {
+            "sessions": sessions,
+            "turns": len(self.turns),
+            "errors": self.errors,
+            "wall_seconds": round(wall, 3),
+            "throughput_turns_per_sec": round(len(self.turns) / wall, 3) if wall else 0.0,
+            "peak_rss_mb": max((s["rss_mb"] for s in timeline), default=round(rss_bytes() / 1e6, 1)),
+            "session_store": self.store.stats(),
+            "latency": metrics,
+            "timeline": timeline,
+        }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test: ลูกค้าหลายคนคุยกับน้องโฟกัสพร้อมกัน (ใช้ตัวจำลอง)")
+    parser.add_argument("--sessions", type=int, default=200, help="จำนวนลูกค้า (บทสนทนา) ทั้งหมด")
+    parser.add_argument("--rate", type=float, default=5.0, help="ลูกค้าใหม่ต่อวินาที (0 = เข้ามาพร้อมกันทั้งหมด)")
+    parser.add_argument("--concurrency", default="8", help="จำนวนรอบที่ทำพร้อมกันได้ ใส่หลายค่าคั่นด้วย , เพื่อเทียบ เช่น 4,8,16")
+    parser.add_argument("--turns", type=int, default=4, help="(บทสนทนาจำลอง) จำนวนข้อความสูงสุดต่อลูกค้า")
+    parser.add_argument("--think-ms", type=float, default=2000, help="เวลาเฉลี่ยที่ลูกค้าเว้นระหว่างข้อความ")
+    parser.add_argument("--conversations", help="ไฟล์ JSONL บทสนทนาจริง (บรรทัดละ {\"turns\": [...]})")
+    parser.add_argument("--stream", action="store_true", help="ตอบแบบ streaming (มี first_chunk)")
+    parser.add_argument("--interval", type=float, default=1.0, help="เก็บ timeline ทุกกี่วินาที")
+    parser.add_argument("--session-db", default="", help="ไฟล์ SQLite ของ session store (ว่าง = ไม่ spill ลงดิสก์)")
+    add_pipeline_args(parser)
+    parser.add_argument("--output", default="load_results.json", help="ไฟล์ JSON ผลลัพธ์")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.conversations:
+        recorded = load_conversations(args.conversations)
+        conversations = [recorded[i % len(recorded)] for i in range(args.sessions)]
+    else:
+        conversations = synthetic_conversations(args.sessions, args.turns, args.seed)
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    total_turns = sum(len(c) for c in conversations)
+    print(f"🧪 Load test: ลูกค้า {len(conversations)} คน ({total_turns} ข้อความ), เข้ามา {args.rate:g} คน/วินาที")
+
+    results = []
+    for concurrency in levels:
+        pipeline = build_fake_pipeline(args)
+        store = SessionStore(path=args.session_db or None)
+        report = asyncio.run(LoadTest(pipeline, concurrency, store, args.stream, args.think_ms).run(
+            conversations, args.rate, args.interval, args.seed))
+        report["concurrency"] = concurrency
+        results.append(report)
+        if not report["turns"]:
+            print(f"  concurrency {concurrency:>3}: ไม่มีรอบที่สำเร็จ (error {report['errors']})")
+            continue
+        latency, queue = report["latency"]["latency"], report["latency"]["queue"]
+        print(f"  concurrency {concurrency:>3}: {report['throughput_turns_per_sec']:>6.2f} turns/sec | "
+              f"latency p50 {latency['p50_ms']:>8.1f} p95 {latency['p95_ms']:>8.1f} p99 {latency['p99_ms']:>8.1f} ms | "
+              f"รอคิว p95 {queue['p95_ms']:>8.1f} ms | RSS สูงสุด {report['peak_rss_mb']:.0f} MB | error {report['errors']}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"config": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"💾 บันทึกผลที่ {args.output} (มี timeline ของแต่ละรอบ)")
@@ -1,8 +1,18 @@
 import os
-import time
 import google.generativeai as genai
 from supabase import create_client, Client
 from dotenv import load_dotenv
+from retrieval import search_products
+from embed_cache import embed_query, cache_stats
+from pipeline import FocusPipeline, FailedReply, gemini_generate
+from intent_router import router
+from device_index import lookup_products, get_index
+from query_filters import parse_filters
+from answer_cache import watch_catalog
+from model_resolver import ResolvedModel
+from prompt_budget import BudgetedPrompt, Conversation
+from scheduler import scheduler
+from metrics import metrics, METRICS_FILE
 
 # 1. โหลดค่าความลับจากไฟล์ .env
 load_dotenv()
@@ -24,67 +34,29 @@ try:
 except Exception as e:
     print(f"❌ ตั้งค่าไม่ผ่าน: {e}")
 
-# 3. ค้นหาโมเดล Flash อัตโนมัติ
-print("🔍 กำลังสแกนหาโมเดล Flash...")
-final_model_name = ""
+# 3. หาโมเดล (จำผลไว้ในแคช ไม่ต้องสแกนทุกครั้งที่เปิด หรือระบุเองด้วย GEMINI_MODEL)
+model = ResolvedModel()
+print(f"🎯 ใช้โมเดล: {model.model_name}")
 
-try:
-    for m in genai.list_models():
-        if 'generateContent' in m.supported_generation_methods:
-            if 'flash' in m.name.lower():
-                final_model_name = m.name
-                if '1.5' in m.name: break 
-
-    if final_model_name:
-        print(f"🎯 ใช้โมเดล: {final_model_name}")
-        clean_name = final_model_name.replace("models/", "")
-        model = genai.GenerativeModel(clean_name)
-    else:
-        print("⚠️ หา Flash ไม่เจอ ใช้ตัวแรกสุดแทน")
-        model = genai.GenerativeModel('gemini-1.5-flash') # Default
+# 4. ฟังก์ชันแชท
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "1") != "0"
 
-except Exception as e:
-    print(f"❌ Error หาโมเดล: {e}")
+def show_found(results):
+    found_items = [item['metadata'].get('model', 'ไม่ระบุรุ่น') for item in results or []]
+    print(f"   (เจอ: {', '.join(found_items)})")
+    return results
 
-# 4. ฟังก์ชันแชท
-def ask_focus(user_question, chat_history_text):
-    print("🤖 น้องโฟกัสกำลังหาข้อมูล...")
-    
-    try:
-        # แปลงคำถามเป็น Vector
-        query_vec = genai.embed_content(
-            model="models/text-embedding-004",
-            content=user_question
-        )['embedding']
-
-        # ค้นหาใน Supabase
-        results = supabase.rpc(
-            "match_products",
-            {
-                "query_embedding": query_vec,
-                "match_threshold": 0.35,
-                "match_count": 5
-            }
-        ).execute()
-        
-        # รวบรวมข้อมูล
-        context = ""
-        found_items = []
-        if results.data:
-            for item in results.data:
-                meta = item['metadata']
-                model_name = meta.get('model', 'ไม่ระบุรุ่น')
-                link = meta.get('link', '#')
-                price = meta.get('price', '-')
-                context += f"- {item['content']} (ราคา: {price} | Link: {link})\n"
-                found_items.append(model_name)
-        else:
-            context = "ไม่พบข้อมูลสินค้าที่ตรงกับคำถาม"
-
-        print(f"   (เจอ: {', '.join(found_items)})") 
-
-        # Prompt
-        final_prompt = f"""
+def lookup(user_question):
+    # ระบุชื่อรุ่นตรงๆ ดึงจากดัชนีชื่อรุ่น
+    results = lookup_products(user_question, supabase)
+    return show_found(results) if results else None
+
+def search(query_vec, **kwargs):
+    # ค้นหาใน Supabase แล้วแสดงรุ่นที่เจอ
+    return show_found(search_products(supabase, query_vec, **kwargs))
+
+def build_prompt(user_question, context, chat_history_text):
+    return f"""
         บทบาท: คุณคือ "น้องโฟกัส" แอดมินขายฟิล์ม Focus Shield
         
         [ข้อมูลสินค้าที่มีในคลัง]
@@ -104,16 +76,34 @@ def ask_focus(user_question, chat_history_text):
         5. ใช้ภาษาพูด น่ารัก เป็นกันเอง
         """
 
-        response = model.generate_content(final_prompt)
-        return response.text
+watch_catalog(supabase)  # แคชคำตอบหมดอายุเมื่อ catalog ใน Supabase เปลี่ยน
+pipeline = FocusPipeline(embed=embed_query, search=search, generate=gemini_generate(model),
+                         prompt_builder=BudgetedPrompt(build_prompt), router=router, lookup=lookup,
+                         parse_filters=lambda text: parse_filters(text, get_index(supabase=supabase)))
+
+def ask_focus(user_question, chat_history_text, on_chunk=None, timings=None):
+    # ถ้าส่ง on_chunk มา จะ stream คำตอบทีละส่วนผ่าน callback นี้ (ยังคืนข้อความเต็มเหมือนเดิม)
+    print("🤖 น้องโฟกัสกำลังหาข้อมูล...")
+    
+    try:
+        if on_chunk:
+            full_text = ""
+            for chunk in pipeline.stream(user_question, chat_history_text, timings):
+                full_text += chunk
+                on_chunk(chunk)
+            return full_text
+
+        return pipeline.answer(user_question, chat_history_text, timings)
 
     except Exception as e:
-        return f"ระบบขัดข้อง: {e}"
+        message = FailedReply(f"ระบบขัดข้อง: {e}")
+        if on_chunk: on_chunk(message)
+        return message
 
 # --- เริ่มรันโปรแกรม ---
 if __name__ == "__main__":
     print("\n🎉 น้องโฟกัส (PC Version) พร้อมทำงาน! (พิมพ์ exit เพื่อจบ)")
-    history_log = []
+    conversation = Conversation()
 
     while True:
         try:
@@ -121,14 +111,48 @@ if __name__ == "__main__":
             if q.lower() == 'exit': break
             if q.strip() == "": continue
             
-            hist_text = "\n".join([f"{h['role']}: {h['msg']}" for h in history_log[-3:]])
-            ans = ask_focus(q, hist_text)
-            
-            print(f"\n⚡ น้องโฟกัส:\n{ans}")
+            hist_text = conversation.render()
+            timings = {}
+            if STREAM_RESPONSES:
+                shown = []
+                def print_chunk(text):
+                    # พิมพ์หัวข้อครั้งเดียวตอนได้ข้อความแรก แล้วต่อข้อความไปเรื่อยๆ
+                    if isinstance(text, FailedReply):
+                        # พังกลางทาง: ข้อความที่พิมพ์ไปแล้วไม่ใช่คำตอบ แสดง error แทน
+                        if shown: print("\n\n⚠️ (คำตอบข้างบนไม่สมบูรณ์ ยกเลิก)")
+                        print(f"\n⚡ น้องโฟกัส:\n{text}", end="", flush=True)
+                        return
+                    if not shown:
+                        print("\n⚡ น้องโฟกัส:")
+                        shown.append(True)
+                    print(text, end="", flush=True)
+                ans = ask_focus(q, hist_text, on_chunk=print_chunk, timings=timings)
+                print()
+            else:
+                ans = ask_focus(q, hist_text, timings=timings)
+                print(f"\n⚡ น้องโฟกัส:\n{ans}")
+            tokens = timings.get("prompt_tokens")
+            if tokens:
+                print(f"   (prompt ~{tokens['total']} tokens: สินค้า {tokens['products']}, ประวัติ {tokens['history']})")
             print("-" * 50)
             
-            history_log.append({"role": "User", "msg": q})
-            history_log.append({"role": "Focus", "msg": ans})
+            # ตอบไม่สำเร็จ ไม่เก็บคำตอบครึ่งๆ กลางๆ / ข้อความ error ลงประวัติ
+            if not isinstance(ans, FailedReply):
+                conversation.add("User", q)
+                conversation.add("Focus", ans)
         except KeyboardInterrupt:
             print("\nปิดโปรแกรม...")
-            break
\ No newline at end of file
+            break
+
+    if router:
+        routes = router.stats()
+        print(f"🚦 ตอบโดยไม่ใช้ LLM {routes['skipped_llm']}/{routes['total']} ข้อความ ({routes['skip_rate']:.0%})")
+    quota = scheduler.stats()
+    print(f"🚥 Scheduler: retry {quota.get('retries', 0)} | failover {quota.get('failovers', 0)} | รวมคำขอซ้ำ {quota.get('coalesced', 0)} | รอคิวเกินเวลา {quota.get('timeouts', 0)}")
+    stats = cache_stats()
+    print(f"📈 Embedding cache: hit rate {stats['hit_rate']:.0%} ({stats['hits'] + stats['disk_hits']} hit / {stats['misses']} miss)")
+    for name, s in metrics.summary().items():
+        if name.startswith("stage:"):
+            print(f"⏱️ {name[6:]:<14} p50 {s['p50'] * 1000:>8.1f} ms | p95 {s['p95'] * 1000:>8.1f} ms")
+    if METRICS_FILE:
+        metrics.write_file(METRICS_FILE)
\ No newline at end of file
@@ -0,0 +1,143 @@
+import os
+import time
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+import numpy as np
+
+# เก็บเวลาแต่ละขั้น / ตัวนับ / ขนาดข้อความ ไว้ในหน่วยความจำ (ใช้ร่วมกันทั้ง process)
+# ส่งออกเป็น Prometheus text format ได้ 3 ทาง: ไฟล์ (METRICS_FILE), HTTP (METRICS_PORT), หรือ sidebar ของ Streamlit
+WINDOW = int(os.getenv("METRICS_WINDOW", "1000"))      # จำนวนค่าล่าสุดต่อขั้นที่ใช้คำนวณ p50/p95
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+FILE_INTERVAL = float(os.getenv("METRICS_FILE_INTERVAL", "15"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+PREFIX = "focus"
+
+
+class Metrics:
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.samples = {}       # ชื่อ -> deque ของค่าล่าสุด (เวลาเป็นวินาที / ขนาดเป็นตัวอักษรหรือ token)
+        self.totals = {}        # ชื่อ -> [count, sum] ตั้งแต่เริ่ม process
+        self.counters = Counter()
+        self.collectors = {}    # ชื่อ -> ฟังก์ชันคืน dict ตัวเลข (อ่านค่าตอน export เช่น cache_stats)
+        self.lock = threading.Lock()
+        self.last_export = 0.0
+
+    def observe(self, name, value):
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+                self.totals[name] = [0, 0.0]
+            self.samples[name].append(value)
+            self.totals[name][0] += 1
+            self.totals[name][1] += value
+
+    def inc(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    @contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f"stage:{stage}", time.perf_counter() - started)
+
+    def register(self, name, collect):
+        self.collectors[name] = collect
+
+    def summary(self):
+        # p50 / p95 ของค่าล่าสุดในแต่ละชื่อ
+        with self.lock:
+            snapshot = {name: list(values) for name, values in self.samples.items()}
+            totals = {name: tuple(total) for name, total in self.totals.items()}
+        result = {}
+        for name, values in snapshot.items():
+            if not values:
+                continue
+            arr = np.asarray(values)
+            result[name] = {
+                "p50": float(np.percentile(arr, 50)),
+                "p95": float(np.percentile(arr, 95)),
+                "count": totals[name][0],
+                "sum": totals[name][1],
+            }
+        return result
+
+    def collected(self):
+        values = {}
+        for name, collect in list(self.collectors.items()):
+            try:
+                for key, value in collect().items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        values[f"{name}_{key}"] = value
+            except Exception:
+                continue
+        return values
+
+    def render(self):
+        # Prometheus text exposition format
+        lines = []
+        for name, stats in sorted(self.summary().items()):
+            # "stage:embed" -> focus_stage_seconds{stage="embed"}, "chars:prompt" -> focus_chars{name="prompt"}
+            kind, label = name.split(":", 1) if ":" in name else ("value", name)
+            metric, key = (f"{PREFIX}_stage_seconds", "stage") if kind == "stage" else (f"{PREFIX}_{kind}", "name")
+            for q in ("p50", "p95"):
+                lines.append(f'{metric}{{{key}="{label}",quantile="0.{q[1:]}"}} {stats[q]:.6g}')
+            lines.append(f'{metric}_count{{{key}="{label}"}} {stats["count"]}')
+            lines.append(f'{metric}_sum{{{key}="{label}"}} {stats["sum"]:.6g}')
+        with self.lock:
+            counters = dict(self.counters)
+        for name, value in sorted(counters.items()):
+            lines.append(f"{PREFIX}_{name}_total {value}")
+        for name, value in sorted(self.collected().items()):
+            lines.append(f"{PREFIX}_{name} {value:.6g}")
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path=METRICS_FILE):
+        if not path:
+            return
+        try:
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(self.render())
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass
+
+    def maybe_export(self, path=METRICS_FILE):
+        # เขียนไฟล์ไม่บ่อยกว่าทุก FILE_INTERVAL วินาที (เรียกหลังจบแต่ละรอบได้เลย)
+        now = time.monotonic()
+        if path and now - self.last_export >= FILE_INTERVAL:
+            self.last_export = now
+            self.write_file(path)
+
+
+metrics = Metrics()
+_server = None
+
+
+def serve(port=METRICS_PORT):
+    # เปิด HTTP endpoint /metrics ใน thread แยก (เรียกซ้ำได้ เปิดครั้งเดียว)
+    global _server
+    if not port or _server is not None:
+        return _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.render().encode("utf-8")
+            self.send_response(200 if self.path.rstrip("/") in ("", "/metrics") else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    _server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    print(f"📊 metrics: http://localhost:{port}/metrics")
+    return _server
@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import threading
+import google.generativeai as genai
+from scheduler import scheduler
+
+# หาโมเดล Gemini ที่ใช้ได้ครั้งเดียว แล้วจำไว้ในไฟล์ (ไม่ต้องเรียก list_models() ทุกครั้งที่เปิดแอป)
+# - ตั้ง GEMINI_MODEL เพื่อระบุโมเดลตายตัว (ไม่สแกนเลย)
+# - จะสแกนใหม่ก็ต่อเมื่อแคชหมดอายุ หรือ generate แล้วเจอ model not found
+DEFAULT_MODEL = "gemini-1.5-flash"
+PINNED_MODEL = os.getenv("GEMINI_MODEL", "").replace("models/", "")
+CACHE_PATH = os.getenv("MODEL_CACHE_PATH", ".model_cache.json")
+CACHE_TTL = int(os.getenv("MODEL_CACHE_TTL", str(24 * 3600)))
+# โมเดลสำรองเวลา quota ของโมเดลหลักหมด (คั่นด้วย ,) ถ้าไม่ตั้ง ใช้ลำดับจากการสแกน
+FALLBACK_MODELS = [m.strip().replace("models/", "") for m in os.getenv("GEMINI_FALLBACK_MODELS", "").split(",") if m.strip()]
+
+
+def is_model_not_found(e):
+    error_msg = str(e).lower()
+    return "404" in error_msg or "not found" in error_msg or "not supported" in error_msg
+
+
+def _rank(name):
+    # ลำดับความชอบเหมือนเดิม: 1.5-flash (quota มากกว่า) > flash อื่นที่ไม่ใช่ 3 > 1.5-pro
+    name = name.lower()
+    if 'flash' in name and '1.5' in name:
+        return 0
+    if 'flash' in name and '3' not in name:
+        return 1
+    if 'pro' in name and '1.5' in name:
+        return 2
+    return None
+
+
+def rank_models(exclude=()):
+    # เรียก list_models() รอบเดียว คืนรายชื่อโมเดลที่ใช้ได้ เรียงจากตัวที่อยากใช้ที่สุด
+    ranked = []
+    for m in genai.list_models():
+        if 'generateContent' not in m.supported_generation_methods:
+            continue
+        name = m.name.replace("models/", "")
+        rank = _rank(name)
+        if name in exclude or rank is None:
+            continue
+        ranked.append((rank, name))
+    return [name for _, name in sorted(ranked)]
+
+
+def scan_models(exclude=()):
+    ranked = rank_models(exclude)
+    return ranked[0] if ranked else None
+
+
+def _load_cache():
+    try:
+        with open(CACHE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(data):
+    try:
+        with open(CACHE_PATH + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(CACHE_PATH + ".tmp", CACHE_PATH)
+    except OSError:
+        pass
+
+
+def resolve_model_name(force=False, exclude=()):
+    if PINNED_MODEL and not exclude:
+        return PINNED_MODEL
+
+    cache = _load_cache()
+    fresh = time.time() - cache.get("resolved_at", 0) < CACHE_TTL
+    # รายชื่อโมเดลที่เคยใช้ไม่ได้ ล้างทิ้งเมื่อแคชหมดอายุ (เผื่อกลับมาใช้ได้)
+    excluded = (set(cache.get("excluded", [])) if fresh else set()) | set(exclude)
+    if not force and fresh and cache.get("model_name") and cache["model_name"] not in excluded:
+        return cache["model_name"]
+
+    try:
+        ranked = rank_models(excluded)
+        model_name = ranked[0] if ranked else DEFAULT_MODEL
+    except Exception as e:
+        # ถ้า list_models() ไม่ได้ ใช้ default
+        print(f"⚠️ ไม่สามารถหาโมเดลได้ ใช้ default: {DEFAULT_MODEL} ({e})")
+        return cache.get("model_name") or DEFAULT_MODEL
+
+    _save_cache({"model_name": model_name, "ranked": ranked, "resolved_at": time.time(), "excluded": sorted(excluded)})
+    return model_name
+
+
+def fallback_models(model_name):
+    # ลำดับโมเดลสำรองสำหรับ failover (ไม่รวมตัวหลัก)
+    ranked = FALLBACK_MODELS or _load_cache().get("ranked", [])
+    return [m for m in ranked if m != model_name]
+
+
+class ResolvedModel:
+    # ใช้แทน genai.GenerativeModel ได้เลย (มี generate_content เหมือนกัน)
+    # ทุกคำขอผ่าน scheduler (จำกัด rate / retry / failover ไปโมเดลสำรองเมื่อ quota หมด)
+    # ถ้าโมเดลปัจจุบันหายไป (404) จะหาโมเดลใหม่แล้วลองอีกครั้งอัตโนมัติ
+    def __init__(self, model_name=None):
+        self.model_name = model_name or resolve_model_name()
+        self.model = genai.GenerativeModel(self.model_name)
+        self.models = {self.model_name: self.model}
+        self.lock = threading.Lock()
+
+    def _switch_model(self, failed_name):
+        with self.lock:
+            if self.model_name != failed_name:
+                return  # thread อื่นเปลี่ยนให้แล้ว
+            new_name = resolve_model_name(force=True, exclude=(failed_name,))
+            print(f"🔁 โมเดล {failed_name} ใช้ไม่ได้ เปลี่ยนเป็น {new_name}")
+            self.model_name = new_name
+            self.model = self._get(new_name)
+
+    def _get(self, name):
+        if name not in self.models:
+            self.models[name] = genai.GenerativeModel(name)
+        return self.models[name]
+
+    def _call(self, name, args, kwargs):
+        return self._get(name).generate_content(*args, **kwargs)
+
+    def generate_content(self, *args, **kwargs):
+        model_name = self.model_name
+        # stream ใช้ผลร่วมกันไม่ได้ (ผลเป็น iterator) นอกนั้นใช้ prompt เป็น key
+        key = None if kwargs.get("stream") else ("generate", repr(args), repr(sorted(kwargs.items())))
+        models = [model_name] + fallback_models(model_name)
+        try:
+            return scheduler.run("generate", lambda name: self._call(name, args, kwargs), models, key=key)
+        except Exception as e:
+            if not is_model_not_found(e):
+                raise
+            self._switch_model(model_name)
+            if self.model_name == model_name:
+                raise
+            return scheduler.run("generate", lambda name: self._call(name, args, kwargs), [self.model_name], key=key)
@@ -0,0 +1,236 @@
+import time
+from collections import namedtuple
+from answer_cache import lookup_answer, store_answer
+from query_filters import narrow
+from metrics import metrics
+
+# ขั้นตอนตอบคำถาม 1 รอบ: embed -> ค้นหาสินค้า -> สร้าง prompt -> generate
+# แยกออกมาจาก app.py เพื่อให้ main.py / bench.py ใช้ร่วมกัน และสลับแต่ละขั้นเป็นตัวจำลองได้
+STAGES = ("parse", "lookup", "embed", "search", "prompt", "generate")
+# เงื่อนไขที่ลูกค้าระบุตัวสินค้าเอง (ค้นไม่เจอ = ไม่มีของ) ส่วนประเภทฟิล์ม / ราคา ผ่อนได้ถ้าไม่เจอ
+HARD_FILTERS = ("brand", "devices")
+
+
+class EmptyReply(ValueError):
+    # generate ไม่ได้ข้อความเลย ถือว่าตอบไม่สำเร็จ (ไม่เก็บลงแคช / ประวัติ)
+    pass
+
+
+class FailedReply(str):
+    # ข้อความแจ้ง error ที่แสดงแทนคำตอบ (app.py / main.py) ไม่ใช่คำตอบจริง จึงไม่เก็บลงประวัติการคุย
+    pass
+
+
+def build_context(results):
+    context = ""
+    if results:
+        for item in results:
+            meta = item['metadata']
+            price = meta.get('price', '-')
+            link = meta.get('link', '#')
+            context += f"- {item['content']} (ราคา: {price} | Link: {link})\n"
+    else:
+        context = "ไม่พบข้อมูลสินค้าที่ตรงกับคำถาม"
+    return context
+
+
+def build_prompt(user_input, context, history_text):
+    return f"""
+    คุณคือ "น้องโฟกัส" แอดมินขายฟิล์ม Focus Shield
+    [ข้อมูลสินค้า]
+    {context}
+    [ประวัติการคุย]
+    {history_text}
+    [คำถามลูกค้า]
+    {user_input}
+
+    --- คำสั่ง ---
+    1. ทักทาย/ถามรุ่น ถ้ายังไม่รู้
+    2. เสนอทางเลือก (ใส/ด้าน/กันมอง) ถ้ารู้รุ่นแล้ว
+    3. ปิดการขาย (ราคา+ลิงก์) เมื่อรู้ครบ
+    4. ห้ามมั่วข้อมูล
+    5. ตอบสั้นๆ น่ารัก เป็นกันเอง
+    """
+
+
+def gemini_generate(model):
+    # ห่อ GenerativeModel ให้เป็น generate(prompt, stream) ที่คืน text หรือ iterator ของ text
+    def generate(prompt, stream=False):
+        if not stream:
+            return model.generate_content(prompt).text
+        return (chunk.text for chunk in model.generate_content(prompt, stream=True) if chunk.parts)
+    return generate
+
+
+def live_pipeline(supabase, model, **kwargs):
+    # pipeline ตัวเดียวกับที่ app.py ใช้ (Gemini + Supabase จริง) ให้ server.py / bench.py สร้างแบบเดียวกัน
+    from retrieval import search_products
+    from embed_cache import embed_query
+    from intent_router import router
+    from device_index import lookup_products, get_index
+    from query_filters import parse_filters
+    from prompt_budget import BudgetedPrompt
+    from answer_cache import watch_catalog
+
+    # แคชคำตอบหมดอายุเมื่อ catalog ใน Supabase เปลี่ยน
+    watch_catalog(supabase)
+
+    options = dict(
+        embed=embed_query,
+        search=lambda query_vec, **search_kwargs: search_products(supabase, query_vec, **search_kwargs),
+        generate=gemini_generate(model),
+        prompt_builder=BudgetedPrompt(build_prompt),
+        router=router,
+        # ดัชนีชื่อรุ่นสร้างจาก Supabase เองถ้าเครื่องนี้ยังไม่มีไฟล์ (เช่น deploy บน Streamlit Cloud / Railway)
+        lookup=lambda text: lookup_products(text, supabase),
+        parse_filters=lambda text: parse_filters(text, get_index(supabase=supabase)),
+    )
+    options.update(kwargs)
+    return FocusPipeline(**options)
+
+
+# ผลของขั้นเตรียม: ถ้า cached ไม่ใช่ None แปลว่าได้คำตอบแล้ว (แคช / template) ไม่ต้อง generate
+Turn = namedtuple("Turn", "query_vec results cached prompt")
+
+
+class FocusPipeline:
+    def __init__(self, embed, search, generate, prompt_builder=build_prompt,
+                 match_threshold=0.35, match_count=5, use_answer_cache=True, router=None, lookup=None,
+                 parse_filters=None):
+        # embed(text) -> vector
+        # search(vector, match_threshold=..., match_count=...) -> list ของสินค้า
+        # generate(prompt, stream=False) -> text (หรือ iterator ของ text ถ้า stream=True)
+        # lookup(text) -> list ของสินค้า หรือ None (เช่น device_index.lookup_products) ถ้าเจอจะข้าม embed + search
+        # parse_filters(text) -> dict เงื่อนไข (query_filters.parse_filters) ส่งต่อให้ search(..., filters=...)
+        self.embed = embed
+        self.search = search
+        self.generate = generate
+        self.prompt_builder = prompt_builder
+        self.match_threshold = match_threshold
+        self.match_count = match_count
+        self.use_answer_cache = use_answer_cache
+        # router (intent_router.IntentRouter) ตอบคำทักทาย / รุ่นที่ไม่มีของ จาก template โดยไม่เรียก LLM
+        self.router = router
+        self.lookup = lookup
+        self.parse_filters = parse_filters
+
+    def prepare(self, user_input, history_text, timings=None):
+        timings = {} if timings is None else timings
+
+        if self.router:
+            reply = self.router.before_retrieval(user_input, history_text)
+            if reply is not None:
+                return Turn(None, [], reply, None)
+
+        # แยกเงื่อนไข (แบรนด์ / รุ่น / ประเภทฟิล์ม / ราคา) ไว้กรองสินค้า
+        filters = {}
+        if self.parse_filters:
+            started = time.perf_counter()
+            filters = self.parse_filters(user_input)
+            timings["parse"] = time.perf_counter() - started
+
+        # คำถามที่ระบุชื่อรุ่นตรงๆ ดึงสินค้าจากดัชนีชื่อรุ่นได้เลย
+        query_vec, results = None, None
+        if self.lookup:
+            started = time.perf_counter()
+            results = narrow(self.lookup(user_input), filters)
+            timings["lookup"] = time.perf_counter() - started
+
+        if not results:
+            started = time.perf_counter()
+            query_vec = self.embed(user_input)
+            timings["embed"] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            kwargs = {"match_threshold": self.match_threshold, "match_count": self.match_count}
+            results = self.search(query_vec, filters=filters, **kwargs) if filters else self.search(query_vec, **kwargs)
+            relaxed = {key: value for key, value in filters.items() if key in HARD_FILTERS}
+            if not results and relaxed != filters:
+                # กรองแล้วไม่เจอ: ผ่อนเฉพาะประเภทฟิล์ม / ราคา แต่คงแบรนด์ / รุ่นไว้ (ไม่ให้สินค้าแบรนด์อื่นปนมา)
+                # ถ้าแบรนด์ / รุ่นที่ระบุไม่มีของเลย ปล่อยผลว่างให้ router ตอบ "ไม่มีของ"
+                results = self.search(query_vec, filters=relaxed, **kwargs) if relaxed else self.search(query_vec, **kwargs)
+            timings["search"] = time.perf_counter() - started
+
+        if self.router:
+            reply = self.router.after_retrieval(user_input, results)
+            if reply is not None:
+                return Turn(query_vec, results, reply, None)
+
+        # คำถามคล้ายเดิม + สินค้าชุดเดิม + ประวัติเดิม ใช้คำตอบจากแคชได้เลย
+        # ทางดัชนีชื่อรุ่นไม่มี embedding: แคชใช้ข้อความคำถาม (normalize แล้ว) + สินค้าชุดเดิมเป็น key
+        if self.use_answer_cache:
+            cached = lookup_answer(query_vec, results, history_text, question=user_input)
+            if cached is not None:
+                if self.router: self.router.record("answer_cache")
+                return Turn(query_vec, results, cached, None)
+
+        if self.router: self.router.record("llm")
+
+        started = time.perf_counter()
+        context = build_context(results)
+        if hasattr(self.prompt_builder, "build"):
+            # prompt_budget.BudgetedPrompt: บันทึกจำนวน token ของ prompt ไว้ใน timings ด้วย
+            prompt, tokens = self.prompt_builder.build(user_input, context, history_text)
+            timings["prompt_tokens"] = tokens
+        else:
+            prompt = self.prompt_builder(user_input, context, history_text)
+        timings["prompt"] = time.perf_counter() - started
+        return Turn(query_vec, results, None, prompt)
+
+    def record(self, timings, turn, reply):
+        # ส่งเวลาแต่ละขั้น / ขนาด prompt และคำตอบ เข้า metrics
+        for stage in STAGES + ("first_chunk",):
+            if stage in timings:
+                metrics.observe(f"stage:{stage}", timings[stage])
+        metrics.inc("turns")
+        if turn.cached is not None:
+            metrics.inc("turns_without_llm")
+        if turn.prompt:
+            metrics.observe("chars:prompt", len(turn.prompt))
+        if "prompt_tokens" in timings:
+            metrics.observe("tokens:prompt", timings["prompt_tokens"]["total"])
+        metrics.observe("chars:response", len(reply or ""))
+        metrics.maybe_export()
+
+    def answer(self, user_input, history_text, timings=None):
+        timings = {} if timings is None else timings
+        turn = self.prepare(user_input, history_text, timings)
+        if turn.cached is not None:
+            self.record(timings, turn, turn.cached)
+            return turn.cached
+
+        started = time.perf_counter()
+        text = self.generate(turn.prompt)
+        timings["generate"] = time.perf_counter() - started
+        if not text:
+            raise EmptyReply("โมเดลไม่ได้ส่งข้อความกลับมา")
+
+        if self.use_answer_cache:
+            store_answer(turn.query_vec, turn.results, text, history_text, question=user_input)
+        self.record(timings, turn, text)
+        return text
+
+    def stream(self, user_input, history_text, timings=None):
+        # เหมือน answer() แต่ส่งข้อความออกมาทีละส่วน (timings["first_chunk"] = เวลาถึงข้อความแรก)
+        timings = {} if timings is None else timings
+        turn = self.prepare(user_input, history_text, timings)
+        if turn.cached is not None:
+            self.record(timings, turn, turn.cached)
+            yield turn.cached
+            return
+
+        started = time.perf_counter()
+        full_text = ""
+        for chunk in self.generate(turn.prompt, stream=True):
+            if not full_text:
+                timings["first_chunk"] = time.perf_counter() - started
+            full_text += chunk
+            yield chunk
+        timings["generate"] = time.perf_counter() - started
+        if not full_text:
+            # stream ที่ถูกบล็อก / ว่าง (gemini_generate ข้าม chunk ที่ไม่มี parts) ห้ามเก็บเป็นคำตอบ
+            raise EmptyReply("โมเดลไม่ได้ส่งข้อความกลับมา (คำตอบว่างหรือถูกบล็อก)")
+
+        if self.use_answer_cache:
+            store_answer(turn.query_vec, turn.results, full_text, history_text, question=user_input)
+        self.record(timings, turn, full_text)
@@ -0,0 +1,156 @@
+import os
+import math
+from collections import deque
+from query_filters import parse_filters
+
+# จำกัดขนาด prompt ด้วยงบ token: แบ่งให้คำสั่ง / ข้อมูลสินค้า / ประวัติการคุย
+# ข้อความเก่าที่ไม่พอดีงบจะถูกย่อเข้า "สรุปก่อนหน้า" ทีละรอบ แทนการส่งซ้ำทั้งหมดหรือทิ้งไปเลย
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+PRODUCT_SHARE = float(os.getenv("PROMPT_PRODUCT_SHARE", "0.6"))  # สัดส่วนของงบที่เหลือ (หลังหักคำสั่ง + คำถาม) ให้ข้อมูลสินค้า
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "8"))
+SUMMARY_LABEL = "[สรุปก่อนหน้า]"
+
+
+def estimate_tokens(text):
+    # ประมาณจำนวน token แบบไม่ต้องเรียก count_tokens() (ประหยัด 1 round trip ต่อข้อความ)
+    # อังกฤษ/ตัวเลข ~4 ตัวอักษรต่อ token, ภาษาไทย ~2.5 ตัวอักษรต่อ token
+    if not text:
+        return 0
+    ascii_chars = sum(1 for c in text if c.isascii() and not c.isspace())
+    other_chars = sum(1 for c in text if not c.isascii())
+    return math.ceil(ascii_chars / 4 + other_chars / 2.5)
+
+
+def clip(text, max_tokens):
+    # ตัดข้อความให้ไม่เกิน max_tokens (เก็บส่วนต้นไว้)
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low].rstrip() + "…"
+
+
+def fit_lines(lines, max_tokens, keep="head"):
+    # เลือกบรรทัดให้พอดีงบ: head = เก็บบรรทัดแรกๆ (สินค้าอันดับต้น), tail = เก็บบรรทัดท้ายๆ (ข้อความล่าสุด)
+    ordered = lines if keep == "head" else list(reversed(lines))
+    chosen, used = [], 0
+    for line in ordered:
+        cost = estimate_tokens(line)
+        if used + cost > max_tokens:
+            break
+        chosen.append(line)
+        used += cost
+    return chosen if keep == "head" else list(reversed(chosen))
+
+
+class Conversation:
+    # ประวัติการคุยของลูกค้า 1 คน: ข้อความล่าสุดแบบเต็ม + สรุปของข้อความที่เก่ากว่า
+    def __init__(self, history_budget=None, max_turns=HISTORY_MAX_TURNS):
+        self.history_budget = history_budget or int(PROMPT_TOKEN_BUDGET * (1 - PRODUCT_SHARE))
+        self.max_turns = max_turns
+        self.turns = deque()
+        self.facts = {}
+        self.folded = 0
+
+    def add(self, role, text):
+        # ข้อความเดียวยาวเกินครึ่งงบ (เช่นคำตอบยาวๆ ของบอท) ตัดให้สั้นลงก่อนเก็บ
+        self.turns.append((role, clip(text, max(1, self.history_budget // 2))))
+        # ย่อข้อความเก่าสุดจนกว่าจะพอดีงบ (ข้อความล่าสุดเก็บไว้เสมอ)
+        while len(self.turns) > 1 and (len(self.turns) > self.max_turns or self.history_tokens() > self.history_budget):
+            self.fold(*self.turns.popleft())
+
+    def fold(self, role, text):
+        # เก็บเฉพาะสิ่งที่ลูกค้าต้องการ (รุ่น / แบรนด์ / ประเภทฟิล์ม / งบ) จากข้อความที่ย่อออกไป
+        self.folded += 1
+        if role.lower() not in ("user", "ลูกค้า"):
+            return
+        for key, value in parse_filters(text).items():
+            if key == "devices":
+                known = self.facts.setdefault("devices", [])
+                known.extend(d for d in value if d not in known)
+            else:
+                self.facts[key] = value
+
+    def summary(self):
+        if not self.folded:
+            return ""
+        parts = []
+        if self.facts.get("devices"):
+            parts.append("รุ่นที่ถามถึง " + ", ".join(self.facts["devices"]))
+        elif self.facts.get("brand"):
+            parts.append(f"แบรนด์ {self.facts['brand']}")
+        if self.facts.get("film_type"):
+            parts.append(f"ฟิล์มแบบ {self.facts['film_type']}")
+        if "max_price" in self.facts:
+            parts.append(f"งบไม่เกิน {self.facts['max_price']:g} บาท")
+        elif "min_price" in self.facts:
+            parts.append(f"งบมากกว่า {self.facts['min_price']:g} บาท")
+        details = " | ".join(parts) if parts else "ยังไม่ระบุรุ่น"
+        return f"{SUMMARY_LABEL} คุยกันมาแล้ว {self.folded} ข้อความ, ลูกค้า: {details}"
+
+    def lines(self):
+        lines = [f"{role}: {text}" for role, text in self.turns]
+        summary = self.summary()
+        return [summary] + lines if summary else lines
+
+    def history_tokens(self):
+        return sum(estimate_tokens(line) for line in self.lines())
+
+    def render(self):
+        return "\n".join(self.lines())
+
+
+class BudgetedPrompt:
+    # ห่อ prompt_builder(user_input, context, history_text) เดิม ให้ตัดสินค้า / ประวัติให้พอดีงบ
+    # ใช้แทน prompt_builder ของ FocusPipeline ได้เลย
+    def __init__(self, template, budget=PROMPT_TOKEN_BUDGET, product_share=PRODUCT_SHARE):
+        self.template = template
+        self.budget = budget
+        self.product_share = product_share
+        self.instruction_tokens = estimate_tokens(template("", "", ""))
+
+    def split(self, user_input):
+        # งบที่เหลือหลังหักคำสั่งและคำถาม แบ่งเป็น (สินค้า, ประวัติ)
+        remaining = max(0, self.budget - self.instruction_tokens - estimate_tokens(user_input))
+        products = int(remaining * self.product_share)
+        return products, remaining - products
+
+    def build(self, user_input, context, history_text):
+        # คืน (prompt, จำนวน token แยกตามส่วน)
+        product_budget, history_budget = self.split(user_input)
+        product_lines = fit_lines(context.splitlines(), product_budget, keep="head")
+        if context and not product_lines:
+            # สินค้าอันดับแรกยาวเกินงบ ตัดให้เหลือบรรทัดเดียว
+            product_lines = [clip(context.splitlines()[0], product_budget)]
+        used = sum(estimate_tokens(line) for line in product_lines)
+        # งบสินค้าที่เหลือใช้ ยกให้ประวัติ
+        history_budget += product_budget - used
+
+        lines = history_text.splitlines() if history_text else []
+        summary = lines.pop(0) if lines and lines[0].startswith(SUMMARY_LABEL) else None
+        if summary:
+            history_budget -= estimate_tokens(summary)
+        history_lines = fit_lines(lines, max(0, history_budget), keep="tail")
+        if lines and not history_lines and history_budget > 0:
+            history_lines = [clip(lines[-1], history_budget)]
+        if summary:
+            history_lines.insert(0, summary)
+
+        context = "\n".join(product_lines)
+        history = "\n".join(history_lines)
+        prompt = self.template(user_input, context, history)
+        return prompt, {
+            "instructions": self.instruction_tokens,
+            "products": used,
+            "history": estimate_tokens(history),
+            "question": estimate_tokens(user_input),
+            "total": estimate_tokens(prompt),
+        }
+
+    def __call__(self, user_input, context, history_text):
+        return self.build(user_input, context, history_text)[0]
@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+from vector_index import VectorIndex, INDEX_DIR, MANIFEST, normalize
+
+# เทียบ recall กับความเร็ว/หน่วยความจำ ของ vector index แบบย่อ (float16 / int8 / ตัดมิติ)
+# เทียบกับการค้นหาแบบ float32 เต็ม (คำตอบที่ถูกต้อง) บน catalog ของเรา หรือ catalog จำลอง (--fake)
+
+
+def load_catalog(args):
+    if args.fake:
+        from fakes import FakeEmbedder, synthetic_catalog
+        embedder = FakeEmbedder(latency_ms=0)
+        items = synthetic_catalog(args.catalog_size)
+        return normalize([embedder.vector(i["content"]) for i in items]), items
+
+    if not os.path.exists(os.path.join(args.index_dir, MANIFEST)):
+        raise SystemExit(f"❌ ไม่พบ vector index ที่ {args.index_dir} (รัน build_brain.py ก่อน หรือใช้ --fake)")
+    index = VectorIndex(args.index_dir)
+    return np.asarray(index.vectors, dtype=np.float32), index.items
+
+
+def load_queries(args, vectors):
+    if args.query_file:
+        # ถามด้วยคำถามจริง (ต้องต่อ Gemini เพื่อ embed)
+        from dotenv import load_dotenv
+        import google.generativeai as genai
+        from embed_cache import embed_query
+        load_dotenv()
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        with open(args.query_file, encoding="utf-8") as f:
+            lines = [json.loads(l)["question"] if l.startswith("{") else l.strip() for l in f if l.strip()]
+        return normalize([embed_query(q) for q in lines])
+
+    # ไม่มีไฟล์คำถาม: ใช้ vector ของสินค้าที่สุ่มมา + noise แทนคำถามที่ใกล้สินค้านั้น
+    rng = np.random.default_rng(args.seed)
+    picks = rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)
+    noise = rng.standard_normal((len(picks), vectors.shape[1])).astype(np.float32)
+    return normalize(vectors[picks] + args.noise * noise / np.sqrt(vectors.shape[1]))
+
+
+def ids(results):
+    return [r["id"] for r in results]
+
+
+def measure(index, queries, k, truth=None):
+    started = time.perf_counter()
+    found = [ids(index.search(q, match_threshold=-1.0, match_count=k)) for q in queries]
+    per_query = (time.perf_counter() - started) / len(queries)
+    report = {"scan_ms": round(per_query * 1000, 3), "bytes": index.nbytes()}
+    if truth is not None:
+        report["recall"] = round(float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)])), 4)
+        report["top1"] = round(float(np.mean([f[:1] == t[:1] for f, t in zip(found, truth)])), 4)
+    return report, found
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="รายงาน recall เทียบความเร็วของ vector index แบบย่อ")
+    parser.add_argument("--index-dir", default=INDEX_DIR, help="snapshot ที่ build_brain.py สร้าง")
+    parser.add_argument("--fake", action="store_true", help="ใช้ catalog จำลองแทน snapshot จริง")
+    parser.add_argument("--catalog-size", type=int, default=20000, help="(fake) จำนวนสินค้าจำลอง")
+    parser.add_argument("--formats", default="float32,float16,int8", help="รูปแบบที่ต้องการเทียบ (คั่นด้วย ,)")
+    parser.add_argument("--dims", default="0,256,128", help="จำนวนมิติที่ตัดเหลือ (0 = ไม่ตัด)")
+    parser.add_argument("--k", type=int, default=5, help="match_count ที่ใช้วัด recall@k")
+    parser.add_argument("--queries", type=int, default=200, help="จำนวนคำถามจำลอง (เมื่อไม่ใช้ --query-file)")
+    parser.add_argument("--query-file", help="ไฟล์คำถามจริง (บรรทัดละคำถาม หรือ JSONL ที่มี question)")
+    parser.add_argument("--noise", type=float, default=0.5, help="(คำถามจำลอง) ระยะห่างจากสินค้าต้นทาง")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="quant_report.json")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    vectors, items = load_catalog(args)
+    queries = load_queries(args, vectors)
+    print(f"📐 catalog {len(items)} รายการ x {vectors.shape[1]} มิติ, คำถาม {len(queries)} ข้อ, k={args.k}")
+
+    baseline, truth = measure(VectorIndex.from_arrays(vectors, items), queries, args.k)
+    rows = [{"format": "float32", "dims": int(vectors.shape[1]), "recall": 1.0, "top1": 1.0, **baseline}]
+    for fmt in [f.strip() for f in args.formats.split(",") if f.strip()]:
+        for dims in [int(d) for d in args.dims.split(",") if d.strip()]:
+            if fmt == "float32" and not dims:
+                continue  # เหมือน baseline
+            index = VectorIndex.from_arrays(vectors, items, fmt=fmt, dims=dims)
+            report, _ = measure(index, queries, args.k, truth)
+            rows.append({"format": fmt, "dims": int(index.compact.shape[1]), **report})
+
+    print(f"{'format':<8} {'dims':>5} {'recall@k':>9} {'top1':>6} {'scan ms':>9} {'MB':>8} {'เล็กลง':>7} {'เร็วขึ้น':>8}")
+    for row in rows:
+        row["memory_ratio"] = round(baseline["bytes"] / row["bytes"], 2)
+        row["speedup"] = round(baseline["scan_ms"] / row["scan_ms"], 2) if row["scan_ms"] else 0.0
+        print(f"{row['format']:<8} {row['dims']:>5} {row['recall']:>9.3f} {row['top1']:>6.3f} {row['scan_ms']:>9.3f} "
+              f"{row['bytes'] / 1e6:>8.2f} {row['memory_ratio']:>6.1f}x {row['speedup']:>7.1f}x")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"catalog": len(items), "queries": len(queries), "k": args.k, "results": rows}, f, ensure_ascii=False, indent=2)
+    print(f"💾 บันทึกผลที่ {args.output}")
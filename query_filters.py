@@ -0,0 +1,127 @@
+import re
+import device_index
+
+# แยกเงื่อนไขจากคำถาม (แบรนด์ / รุ่น / ประเภทฟิล์ม / ช่วงราคา) เพื่อส่งไปกรองสินค้าก่อนจัดอันดับด้วย vector
+# เงื่อนไขเทียบกับ metadata ที่ build_brain.py เขียนไว้: brand, device, film_type, price
+
+# ชื่อเรียกแบรนด์ -> ชื่อแบรนด์มาตรฐาน (ตรงกับ metadata["brand"])
+BRAND_ALIASES = {
+    "apple": ("apple", "แอปเปิ้ล", "แอปเปิล", "iphone", "ไอโฟน"),
+    "samsung": ("samsung", "ซัมซุง", "ซำซุง", "galaxy", "กาแลคซี่", "กาแล็คซี่"),
+    "xiaomi": ("xiaomi", "เสี่ยวมี่", "redmi", "เรดมี่", "poco"),
+    "oppo": ("oppo", "ออปโป้", "ออปโป"),
+    "vivo": ("vivo", "วีโว่"),
+    "realme": ("realme", "เรียลมี"),
+    "huawei": ("huawei", "หัวเว่ย"),
+    "honor": ("honor",),
+    "google": ("google", "pixel"),
+    "oneplus": ("oneplus",),
+    "nokia": ("nokia", "โนเกีย"),
+    "infinix": ("infinix",),
+    "tecno": ("tecno",),
+}
+
+# ประเภทฟิล์มมาตรฐาน -> คำที่ใช้เรียก (ใช้ทั้งจับจากคำถาม และจัดหมวดจาก product_types)
+# เรียงตามลำดับความสำคัญ: "ฟิล์มกันมองแบบด้าน" นับเป็นกันมอง
+FILM_TYPES = {
+    "privacy": r"(กันมอง|กันเสือก|privacy)",
+    "matte": r"(ด้าน(?!หลัง|หน้า|ข้าง)|matte|anti[- ]?glare)",
+    "clear": r"(ใส(?![่้])|clear|\bhd\b)",
+}
+
+PRICE_CUE = r"(บาท|฿|ราคา|งบ|ไม่เกิน|ต่ำกว่า|ถูกกว่า|น้อยกว่า|มากกว่า|สูงกว่า|under|below|over|above|budget)"
+NUMBER = r"(\d[\d,]*)"
+
+
+def brand_key(brand):
+    # ชื่อแบรนด์จาก devices.brand_name -> ชื่อมาตรฐาน
+    lowered = (brand or "").strip().lower()
+    for key, aliases in BRAND_ALIASES.items():
+        if lowered in aliases:
+            return key
+    return " ".join(device_index.normalize(lowered))
+
+
+def film_type(*texts):
+    # จัดหมวดฟิล์มจากข้อความ (main_category / sub_category / features หรือคำถามลูกค้า)
+    text = " ".join(str(t) for t in texts if t).lower()
+    for key, pattern in FILM_TYPES.items():
+        if re.search(pattern, text):
+            return key
+    return None
+
+
+def _number(value):
+    return float(value.replace(",", ""))
+
+
+def parse_price(text):
+    # คืน (min_price, max_price) เฉพาะเมื่อมีคำบอกว่าพูดถึงราคา (กันเลขรุ่น เช่น iPhone 15 ถูกตีเป็นราคา)
+    text = (text or "").lower()
+    if not re.search(PRICE_CUE, text):
+        return None, None
+    match = re.search(rf"{NUMBER}\s*(?:-|–|ถึง|to)\s*{NUMBER}", text)
+    if match:
+        low, high = sorted((_number(match.group(1)), _number(match.group(2))))
+        return low, high
+    min_price = max_price = None
+    match = re.search(rf"(ไม่เกิน|ต่ำกว่า|ถูกกว่า|น้อยกว่า|under|below|less than|งบ|<)\s*{NUMBER}", text)
+    if match:
+        max_price = _number(match.group(2))
+    match = re.search(rf"((?<!ไม่)เกิน|มากกว่า|สูงกว่า|over|above|more than|>)\s*{NUMBER}", text)
+    if match:
+        min_price = _number(match.group(2))
+    return min_price, max_price
+
+
+def parse_filters(text, devices=None):
+    # คืน dict ของเงื่อนไขที่เจอ (ไม่เจอเลยคืน {}) devices = DeviceIndex ที่ใช้หาชื่อรุ่น
+    filters = {}
+    tokens = set(device_index.normalize(text))
+    lowered = (text or "").lower()
+    brands = [key for key, aliases in BRAND_ALIASES.items()
+              if any(a in tokens or (not a.isascii() and a in lowered) for a in aliases)]
+    if len(brands) == 1:
+        filters["brand"] = brands[0]
+
+    devices = devices if devices is not None else device_index.get_index()
+    if devices is not None:
+        found = devices.find_devices(text)
+        if found:
+            filters["devices"] = found
+            filters.pop("brand", None)  # รุ่นระบุแบรนด์อยู่แล้ว
+
+    kind = film_type(text)
+    if kind:
+        filters["film_type"] = kind
+
+    min_price, max_price = parse_price(text)
+    if min_price is not None:
+        filters["min_price"] = min_price
+    if max_price is not None:
+        filters["max_price"] = max_price
+    return filters
+
+
+def matches(metadata, filters):
+    if "brand" in filters and metadata.get("brand") != filters["brand"]:
+        return False
+    if "devices" in filters and metadata.get("device") not in filters["devices"]:
+        return False
+    if "film_type" in filters and metadata.get("film_type") != filters["film_type"]:
+        return False
+    if "min_price" in filters or "max_price" in filters:
+        try:
+            price = float(metadata.get("price"))
+        except (TypeError, ValueError):
+            return False
+        if price < filters.get("min_price", price) or price > filters.get("max_price", price):
+            return False
+    return True
+
+
+def narrow(results, filters):
+    # กรองผลลัพธ์ที่ได้มาแล้ว ถ้ากรองแล้วไม่เหลือเลยคืนชุดเดิม (ให้ LLM บอกลูกค้าว่ามีแบบไหนบ้าง)
+    if not results or not filters:
+        return results
+    return [item for item in results if matches(item["metadata"], filters)] or results
@@ -0,0 +1,43 @@
+import time
+import threading
+
+# Token bucket สำหรับจำกัดจำนวนคำขอต่อนาทีให้อยู่ใน quota ของ Gemini
+# ใช้ร่วมกันได้หลาย thread: ทุกคนเรียก acquire() ก่อนยิง API
+class TokenBucket:
+    def __init__(self, rate_per_minute, burst=None):
+        self.rate = rate_per_minute / 60.0  # token ต่อวินาที
+        self.capacity = float(burst or max(1, int(rate_per_minute // 4)))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        with self.lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1, timeout=None):
+        # รอจนกว่าจะมี token (คืน False ถ้ารอเกิน timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return True
+                wait = (tokens - self.tokens) / self.rate
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
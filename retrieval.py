@@ -0,0 +1,74 @@
+import os
+import vector_index
+from query_filters import matches
+from metrics import metrics
+
+# เลือกวิธีค้นหาสินค้า: "supabase" (RPC match_products) หรือ "local" (vector index ในเครื่อง)
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "supabase").lower()
+
+
+# RPC ที่รับเงื่อนไขกรอง (สร้างจาก sql/match_products_filtered.sql)
+# ถ้ายังไม่ได้สร้างใน Supabase จะใช้ match_products เดิมแล้วกรองฝั่งเราแทน
+_filtered_rpc_available = True
+
+
+def _is_missing_function(e):
+    # PostgREST ตอบ PGRST202 เมื่อยังไม่มีฟังก์ชันนี้ในฐานข้อมูล
+    return getattr(e, "code", None) == "PGRST202" or "could not find the function" in str(e).lower()
+
+
+def search_products(supabase, query_embedding, match_threshold=0.35, match_count=5, filters=None):
+    # ค้นหาสินค้าที่ใกล้กับคำถาม คืนค่าเป็น list ของ {content, metadata, similarity}
+    # filters (query_filters.parse_filters) ส่งลงไปกรองก่อนจัดอันดับ
+    if RETRIEVAL_BACKEND == "local":
+        index = vector_index.get_index(supabase)
+        if index is not None:
+            with metrics.span("vector_index"):
+                return index.search(query_embedding, match_threshold, match_count, filters)
+
+    with metrics.span("match_products"):
+        if filters:
+            return _search_filtered(supabase, query_embedding, match_threshold, match_count, filters)
+        return _match_products(supabase, query_embedding, match_threshold, match_count)
+
+
+def _search_filtered(supabase, query_embedding, match_threshold, match_count, filters):
+    global _filtered_rpc_available
+    if _filtered_rpc_available:
+        try:
+            results = supabase.rpc(
+                "match_products_filtered",
+                {
+                    "query_embedding": query_embedding,
+                    "match_threshold": match_threshold,
+                    "match_count": match_count,
+                    "filter_brand": filters.get("brand"),
+                    "filter_devices": filters.get("devices"),
+                    "filter_film_type": filters.get("film_type"),
+                    "min_price": filters.get("min_price"),
+                    "max_price": filters.get("max_price"),
+                }
+            ).execute()
+            return results.data or []
+        except Exception as e:
+            # error อื่น (timeout / เครือข่าย / SQL) ส่งต่อตามปกติ ไม่ปิด RPC นี้ทิ้งทั้ง process
+            if not _is_missing_function(e):
+                raise
+            print(f"⚠️ ยังไม่ได้สร้าง match_products_filtered ใช้ match_products แล้วกรองเองแทน ({e})")
+            _filtered_rpc_available = False
+
+    # ดึงเผื่อไว้มากกว่าเดิม แล้วกรองฝั่งเรา
+    results = _match_products(supabase, query_embedding, match_threshold, match_count * 4)
+    return [item for item in results if matches(item["metadata"], filters)][:match_count]
+
+
+def _match_products(supabase, query_embedding, match_threshold, match_count):
+    results = supabase.rpc(
+        "match_products",
+        {
+            "query_embedding": query_embedding,
+            "match_threshold": match_threshold,
+            "match_count": match_count
+        }
+    ).execute()
+    return results.data or []
@@ -0,0 +1,172 @@
+import os
+import re
+import time
+import random
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from rate_limit import TokenBucket
+from metrics import metrics
+
+# ตัวจัดคิวคำขอไป Gemini ใช้ร่วมกันทั้ง process (ทุก session ของ Streamlit / ทุก worker)
+# - token bucket แยกตามโมเดล ตามขนาด quota
+# - คำขอเดียวกันที่กำลังรอผลอยู่ ใช้ผลร่วมกัน (ไม่ยิงซ้ำ)
+# - เจอ 429 ของโมเดลไหน พักโมเดลนั้นแล้วย้ายไปตัวถัดไปในรายการ
+# - error ชั่วคราว ลองใหม่แบบ exponential backoff + jitter
+# - รอคิวได้ไม่เกิน QUOTA_MAX_WAIT วินาที แล้วค่อยแจ้ง error
+GENERATE_RPM = int(os.getenv("GEMINI_RPM", "15"))
+EMBED_RPM = int(os.getenv("GEMINI_EMBED_RPM", "1500"))
+MAX_WAIT = float(os.getenv("QUOTA_MAX_WAIT", "30"))
+MAX_RETRIES = int(os.getenv("QUOTA_MAX_RETRIES", "4"))
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 20.0
+QUOTA_COOLDOWN = 60.0      # พักโมเดลที่ quota หมด (ถ้า error ไม่ได้บอกเวลาไว้)
+NOT_FOUND_COOLDOWN = 3600.0
+
+
+class QuotaExceeded(Exception):
+    # ข้อความขึ้นต้นด้วย 429 ให้ app.py แสดงข้อความ quota เหมือนเดิม
+    def __init__(self, detail):
+        super().__init__(f"429 quota exceeded: {detail}")
+
+
+def is_quota_error(e):
+    msg = str(e).lower()
+    return "429" in msg or "quota" in msg or "resource exhausted" in msg or "resourceexhausted" in msg
+
+
+def is_transient_error(e):
+    msg = str(e).lower()
+    return bool(re.search(r"\b(500|502|503|504)\b|unavailable|deadline|timeout|timed out|connection", msg))
+
+
+def is_not_found_error(e):
+    msg = str(e).lower()
+    return "404" in msg or "not found" in msg or "not supported" in msg
+
+
+def retry_after(e):
+    # Gemini บอกเวลาที่ควรรอมาในข้อความ เช่น "Please retry in 12.3s" หรือ "retry_delay { seconds: 12 }"
+    match = re.search(r"retry in ([\d.]+)\s*s", str(e)) or re.search(r"seconds:\s*(\d+)", str(e))
+    return float(match.group(1)) if match else None
+
+
+class QuotaScheduler:
+    def __init__(self, rates=None, max_wait=MAX_WAIT, max_retries=MAX_RETRIES):
+        # rates: {kind: คำขอต่อนาทีต่อโมเดล}
+        self.rates = rates or {"generate": GENERATE_RPM, "embed": EMBED_RPM}
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.buckets = {}
+        self.cooldown = {}      # model -> เวลาที่ใช้ได้อีกครั้ง
+        self.inflight = {}      # key -> Future
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def bucket(self, kind, model):
+        with self.lock:
+            if (kind, model) not in self.buckets:
+                self.buckets[(kind, model)] = TokenBucket(self.rates.get(kind, GENERATE_RPM))
+            return self.buckets[(kind, model)]
+
+    def count(self, name):
+        # ตัวนับถูกเรียกจากหลาย thread พร้อมกัน ต้องถือ lock ไม่งั้นค่าหาย
+        with self.lock:
+            self.counts[name] += 1
+
+    def available(self, models):
+        now = time.monotonic()
+        return [m for m in models if self.cooldown.get(m, 0) <= now]
+
+    def rest(self, model, seconds):
+        with self.lock:
+            self.cooldown[model] = max(self.cooldown.get(model, 0), time.monotonic() + seconds)
+
+    def run(self, kind, call, models, key=None, max_wait=None):
+        # call(model_name) -> ผลลัพธ์, models = รายชื่อโมเดลเรียงตามลำดับที่อยากใช้
+        # key: คำขอที่ key เดียวกันและยังรอผลอยู่ จะได้ผลเดียวกัน (None = ไม่รวม เช่น stream)
+        if key is None:
+            return self._execute(kind, call, models, max_wait)
+
+        with self.lock:
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self.inflight[key] = Future()
+            else:
+                self.counts["coalesced"] += 1
+        if not owner:
+            return future.result()
+
+        try:
+            result = self._execute(kind, call, models, max_wait)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+    def _execute(self, kind, call, models, max_wait=None):
+        max_wait = self.max_wait if max_wait is None else max_wait
+        deadline = time.monotonic() + max_wait
+        self.count(f"{kind}_calls")
+        attempt = 0
+        last_error = None
+        while True:
+            candidates = self.available(models)
+            if not candidates:
+                # ทุกโมเดลพักอยู่ รอตัวที่กลับมาเร็วที่สุด (ถ้าไม่เกินเวลาที่รอได้)
+                ready_at = min(self.cooldown.get(m, 0) for m in models)
+                if ready_at >= deadline:
+                    self.count("timeouts")
+                    raise QuotaExceeded(f"ทุกโมเดลใช้ quota หมด ({last_error})")
+                time.sleep(max(0.0, ready_at - time.monotonic()))
+                continue
+
+            model = candidates[0]
+            if not self.bucket(kind, model).acquire(timeout=max(0.0, deadline - time.monotonic())):
+                self.count("timeouts")
+                raise QuotaExceeded(f"รอคิว {kind} เกิน {max_wait:g} วินาที")
+
+            started = time.perf_counter()
+            try:
+                result = call(model)
+                metrics.observe(f"stage:gemini_{kind}", time.perf_counter() - started)
+                return result
+            except Exception as e:
+                last_error = e
+                if is_quota_error(e):
+                    self.count("rate_limited")
+                    # quota ของโมเดลนี้หมด พักไว้แล้วลองตัวถัดไปทันที
+                    self.rest(model, retry_after(e) or QUOTA_COOLDOWN)
+                    self.count("failovers" if len(candidates) > 1 else "quota_errors")
+                    continue
+                if is_not_found_error(e) and len(candidates) > 1:
+                    self.rest(model, NOT_FOUND_COOLDOWN)
+                    self.count("failovers")
+                    continue
+                if not is_transient_error(e) or attempt >= self.max_retries:
+                    raise
+
+                # full jitter: สุ่มเวลารอ 0..min(cap, base * 2^attempt) กันทุก thread ยิงพร้อมกัน
+                delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+                if time.monotonic() + delay >= deadline:
+                    raise
+                attempt += 1
+                self.count("retries")
+                time.sleep(delay)
+
+    def stats(self):
+        with self.lock:
+            now = time.monotonic()
+            return {
+                **self.counts,
+                "resting_models": sorted(m for m, t in self.cooldown.items() if t > now),
+            }
+
+
+scheduler = QuotaScheduler()
+metrics.register("scheduler", scheduler.stats)
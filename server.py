@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import google.generativeai as genai
+from supabase import create_client
+from dotenv import load_dotenv
+from pipeline import live_pipeline
+from session_store import store as session_store, SWEEP_INTERVAL
+from model_resolver import ResolvedModel
+from scheduler import is_quota_error
+from metrics import metrics
+
+# HTTP API สำหรับ webhook (LINE / Facebook) ใช้ logic เดียวกับ app.py แต่ไม่ต้องเปิด browser ต่อ session
+# asyncio รับ connection ได้หลายร้อยพร้อมกัน ส่วนงานที่ block (Gemini / Supabase) รันใน thread pool ขนาดจำกัด
+#
+#   POST   /chat              {"session_id": "...", "message": "...", "stream": false}
+#   DELETE /sessions/<id>     ล้างประวัติการคุย
+#   GET    /health            สถานะ server
+#   GET    /metrics           Prometheus text format
+HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", os.getenv("SERVER_PORT", "8080")))
+MAX_CONCURRENCY = int(os.getenv("SERVER_MAX_CONCURRENCY", "32"))   # จำนวนรอบที่ประมวลผลพร้อมกัน
+QUEUE_TIMEOUT = float(os.getenv("SERVER_QUEUE_TIMEOUT", "30"))     # รอคิวได้นานสุดกี่วินาที
+MAX_BODY = 64 * 1024
+
+class BadRequest(Exception):
+    # request อ่านไม่ได้ (400) หรือ body ใหญ่เกิน (413)
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+STATUS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+          413: "Payload Too Large", 429: "Too Many Requests", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class ChatService:
+    # ถือ pipeline / ประวัติการคุยของแต่ละ session และจำกัดจำนวนรอบที่ทำพร้อมกัน
+    def __init__(self, pipeline, store=session_store, max_concurrency=MAX_CONCURRENCY, queue_timeout=QUEUE_TIMEOUT):
+        self.pipeline = pipeline
+        self.store = store
+        self.max_concurrency = max_concurrency
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="focus")
+        # งานของ session store (SQLite) รันใน thread แยก ไม่ block event loop
+        self.store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sessions")
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.queue_timeout = queue_timeout
+        self.locks = {}
+        self.in_flight = 0
+
+    async def in_store(self, call, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.store_executor, call, *args)
+
+    async def session(self, session_id):
+        # ข้อความของ session เดียวกันตอบทีละข้อความ ตามลำดับ
+        if session_id not in self.locks:
+            self.locks[session_id] = asyncio.Lock()
+        return await self.in_store(self.store.get, session_id), self.locks[session_id]
+
+    async def save_turn(self, session, message, reply):
+        def save():
+            self.store.add(session, "user", message)
+            self.store.add(session, "assistant", reply)
+        await self.in_store(save)
+
+    async def reset(self, session_id):
+        self.locks.pop(session_id, None)
+        return await self.in_store(self.store.reset, session_id)
+
+    async def stats(self):
+        return await self.in_store(self.store.stats)
+
+    async def sweep(self):
+        # เอา session ที่เงียบนานออกจากหน่วยความจำเป็นระยะ (แม้ไม่มีคำขอใหม่เข้ามา)
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            for session_id in await self.in_store(self.store.evict_idle):
+                lock = self.locks.get(session_id)
+                if lock is not None and not lock.locked():
+                    del self.locks[session_id]
+
+    async def acquire(self):
+        # รอคิวได้ไม่เกิน queue_timeout (คืน False ถ้าเต็มนานเกินไป)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            metrics.inc("server_rejected")
+            return False
+        metrics.observe("stage:server_queue", time.perf_counter() - started)
+        return True
+
+    async def answer(self, session_id, message):
+        session, lock = await self.session(session_id)
+        async with lock:
+            history = session.conversation.render()
+            loop = asyncio.get_running_loop()
+            self.in_flight += 1
+            try:
+                reply = await loop.run_in_executor(self.executor, self.pipeline.answer, message, history)
+            finally:
+                self.in_flight -= 1
+            await self.save_turn(session, message, reply)
+            return reply
+
+    async def stream(self, session_id, message):
+        # แปลง pipeline.stream (generator ธรรมดา) เป็น async generator ผ่าน queue
+        session, lock = await self.session(session_id)
+        async with lock:
+            history = session.conversation.render()
+            loop = asyncio.get_running_loop()
+            chunks = asyncio.Queue()
+            done = object()
+
+            def produce():
+                try:
+                    for chunk in self.pipeline.stream(message, history):
+                        loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+                except Exception as e:
+                    loop.call_soon_threadsafe(chunks.put_nowait, e)
+                finally:
+                    loop.call_soon_threadsafe(chunks.put_nowait, done)
+
+            self.in_flight += 1
+            loop.run_in_executor(self.executor, produce)
+            reply = ""
+            try:
+                while True:
+                    chunk = await chunks.get()
+                    if chunk is done:
+                        break
+                    if isinstance(chunk, Exception):
+                        raise chunk
+                    reply += chunk
+                    yield chunk
+            finally:
+                self.in_flight -= 1
+            await self.save_turn(session, message, reply)
+
+
+def error_reply(e):
+    if is_quota_error(e):
+        return 429, "ขอโทษนะคะ ตอนนี้มีลูกค้าทักเข้ามาเยอะมาก รบกวนรอสักครู่แล้วลองใหม่อีกครั้งนะคะ 🙏"
+    return 500, "ขออภัยค่ะ ระบบขัดข้องชั่วคราว รบกวนลองใหม่อีกครั้งนะคะ 🙏"
+
+
+async def read_request(reader):
+    # อ่าน request line + header + body (รองรับเฉพาะ Content-Length)
+    try:
+        line = await reader.readline()
+        if not line:
+            return None
+        method, path, _ = line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        # request line ผิดรูปแบบ / Content-Length ไม่ใช่ตัวเลข / บรรทัดยาวเกิน limit ของ reader
+        raise BadRequest(400, "request ไม่ถูกต้อง")
+    if length < 0:
+        raise BadRequest(400, "Content-Length ไม่ถูกต้อง")
+    if length > MAX_BODY:
+        raise BadRequest(413, "body ใหญ่เกินไป")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), path.split("?", 1)[0], headers, body
+
+
+def write_response(writer, status, body, content_type="application/json; charset=utf-8", keep_alive=True):
+    if not isinstance(body, (bytes, str)):
+        body = json.dumps(body, ensure_ascii=False)
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    head = (f"HTTP/1.1 {status} {STATUS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode("latin-1") + body)
+
+
+async def handle_chat(service, writer, body, keep_alive=True):
+    try:
+        payload = json.loads(body or b"{}")
+        message = str(payload.get("message", "")).strip()
+    except (ValueError, AttributeError):
+        write_response(writer, 400, {"error": "body ต้องเป็น JSON"}, keep_alive=keep_alive)
+        return keep_alive
+    if not message:
+        write_response(writer, 400, {"error": "ต้องมี message"}, keep_alive=keep_alive)
+        return keep_alive
+    session_id = str(payload.get("session_id") or uuid.uuid4().hex)
+
+    if not await service.acquire():
+        write_response(writer, 503, {"session_id": session_id, "error": "server busy"}, keep_alive=keep_alive)
+        return keep_alive
+    try:
+        if not payload.get("stream"):
+            try:
+                reply = await service.answer(session_id, message)
+                write_response(writer, 200, {"session_id": session_id, "reply": reply}, keep_alive=keep_alive)
+            except Exception as e:
+                status, reply = error_reply(e)
+                write_response(writer, status, {"session_id": session_id, "reply": reply, "error": str(e)},
+                               keep_alive=keep_alive)
+            return keep_alive
+
+        # stream แบบ Server-Sent Events: ส่งทีละ chunk แล้วปิด connection เมื่อจบ
+        writer.write(("HTTP/1.1 200 OK\r\n"
+                      "Content-Type: text/event-stream; charset=utf-8\r\n"
+                      "Cache-Control: no-cache\r\n"
+                      "Connection: close\r\n\r\n").encode("latin-1"))
+        try:
+            async for chunk in service.stream(session_id, message):
+                writer.write(f"data: {json.dumps({'text': chunk}, ensure_ascii=False)}\n\n".encode("utf-8"))
+                await writer.drain()
+            end = {"session_id": session_id, "done": True}
+        except Exception as e:
+            status, reply = error_reply(e)
+            end = {"session_id": session_id, "done": True, "status": status, "text": reply, "error": str(e)}
+        writer.write(f"data: {json.dumps(end, ensure_ascii=False)}\n\n".encode("utf-8"))
+        return False
+    finally:
+        service.slots.release()
+
+
+async def handle_connection(service, reader, writer):
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except BadRequest as e:
+                write_response(writer, e.status, {"error": str(e)}, keep_alive=False)
+                await writer.drain()
+                break
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            if request is None:
+                break
+            method, path, headers, body = request
+            keep_alive = headers.get("connection", "").lower() != "close"
+
+            if path == "/chat" and method == "POST":
+                keep_alive = await handle_chat(service, writer, body, keep_alive)
+            elif path.startswith("/sessions/") and method == "DELETE":
+                found = await service.reset(path[len("/sessions/"):])
+                write_response(writer, 200 if found else 404, {"deleted": found}, keep_alive=keep_alive)
+            elif path == "/health" and method == "GET":
+                write_response(writer, 200, {"ok": True, "in_flight": service.in_flight, **(await service.stats())},
+                               keep_alive=keep_alive)
+            elif path == "/metrics" and method == "GET":
+                write_response(writer, 200, metrics.render(), "text/plain; version=0.0.4; charset=utf-8", keep_alive)
+            else:
+                write_response(writer, 404, {"error": "not found"}, keep_alive=keep_alive)
+            await writer.drain()
+            if not keep_alive:
+                break
+    finally:
+        writer.close()
+
+
+async def serve(service, host=HOST, port=PORT):
+    server = await asyncio.start_server(lambda r, w: handle_connection(service, r, w), host, port, limit=MAX_BODY)
+    print(f"🚀 น้องโฟกัส API พร้อมที่ http://{host}:{port} (ทำพร้อมกันได้ {service.max_concurrency} รอบ)")
+    sweeper = asyncio.create_task(service.sweep())
+    async with server:
+        try:
+            await server.serve_forever()
+        finally:
+            sweeper.cancel()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    # client ชุดเดียวใช้ร่วมกันทุก session (connection pool ของ Supabase / Gemini + scheduler คุม quota)
+    supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+    model = ResolvedModel()
+    print(f"🎯 ใช้โมเดล: {model.model_name}")
+    try:
+        asyncio.run(serve(ChatService(live_pipeline(supabase, model))))
+    except KeyboardInterrupt:
+        print("\nปิด server...")
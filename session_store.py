@@ -0,0 +1,184 @@
+import os
+import sys
+import time
+import sqlite3
+import threading
+from collections import deque
+from prompt_budget import Conversation
+from metrics import metrics
+
+# เก็บบทสนทนาของลูกค้าแต่ละคนฝั่ง server (ใช้ร่วมกันทั้ง process: ทุก session ของ Streamlit / server.py)
+# - ในหน่วยความจำเก็บแค่ข้อความล่าสุด SESSION_RECENT_TURNS ข้อความ (ring buffer) + Conversation ที่ใช้ทำ prompt
+# - ข้อความที่เก่ากว่านั้นย้ายไปเก็บใน SQLite (ดูย้อนหลังได้ ไม่กินหน่วยความจำ)
+# - session ที่ไม่มีความเคลื่อนไหวเกิน SESSION_TTL วินาที ถูกเอาออกจากหน่วยความจำ (กลับมาคุยต่อได้ โหลดจาก SQLite)
+RECENT_TURNS = int(os.getenv("SESSION_RECENT_TURNS", "20"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", ".sessions.sqlite")
+RETENTION_DAYS = float(os.getenv("SESSION_RETENTION_DAYS", "30"))   # ลบข้อความใน SQLite ที่เก่ากว่านี้
+SWEEP_INTERVAL = 60.0
+
+
+class Message:
+    # ข้อความ 1 ข้อความ (__slots__ ไม่มี __dict__ ต่อ object)
+    __slots__ = ("seq", "role", "text", "at")
+
+    def __init__(self, seq, role, text, at):
+        self.seq = seq
+        self.role = role
+        self.text = text
+        self.at = at
+
+
+class Session:
+    __slots__ = ("id", "recent", "conversation", "next_seq", "last_seen")
+
+    def __init__(self, session_id, recent_turns=RECENT_TURNS):
+        self.id = session_id
+        self.recent = deque(maxlen=recent_turns)
+        self.conversation = Conversation()
+        self.next_seq = 0
+        self.last_seen = time.monotonic()
+
+    @property
+    def spilled(self):
+        # จำนวนข้อความที่อยู่ใน SQLite อย่างเดียว (ไม่อยู่ใน ring buffer แล้ว)
+        return self.recent[0].seq if self.recent else self.next_seq
+
+    def nbytes(self):
+        # ขนาดโดยประมาณที่ session นี้ใช้ในหน่วยความจำ (object + ข้อความ + Conversation)
+        size = sys.getsizeof(self) + sys.getsizeof(self.id) + sys.getsizeof(self.recent)
+        size += sum(sys.getsizeof(m) + sys.getsizeof(m.text) for m in self.recent)
+        conv = self.conversation
+        size += sys.getsizeof(conv) + sys.getsizeof(conv.__dict__) + sys.getsizeof(conv.turns) + sys.getsizeof(conv.facts)
+        size += sum(sys.getsizeof(turn) + sys.getsizeof(turn[1]) for turn in conv.turns)
+        return size
+
+
+class SessionStore:
+    def __init__(self, path=SESSION_DB_PATH, recent_turns=RECENT_TURNS, ttl=SESSION_TTL, retention_days=RETENTION_DAYS):
+        self.recent_turns = recent_turns
+        self.ttl = ttl
+        self.retention = retention_days * 86400
+        self.sessions = {}
+        self.evicted = 0
+        self.spilled = 0
+        self.restored = 0
+        self.last_sweep = time.monotonic()
+        self.lock = threading.RLock()
+
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            # WAL + synchronous=NORMAL: commit ทุกข้อความได้โดยไม่ต้อง fsync ทุกครั้ง
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS turns (session_id TEXT, seq INTEGER, role TEXT, text TEXT, at REAL, "
+                "PRIMARY KEY (session_id, seq))"
+            )
+            self.db.commit()
+
+    def get(self, session_id):
+        # คืน session (สร้างใหม่ หรือโหลดกลับจาก SQLite ถ้าเคยถูกเอาออกจากหน่วยความจำ)
+        with self.lock:
+            self.maybe_sweep()
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = self.sessions[session_id] = self._restore(session_id)
+            session.last_seen = time.monotonic()
+            return session
+
+    def add(self, session, role, text):
+        with self.lock:
+            if len(session.recent) == session.recent.maxlen:
+                # ข้อความเก่าสุดกำลังจะหลุดจาก ring buffer ย้ายไปเก็บใน SQLite ก่อน
+                self._spill(session.id, [session.recent[0]])
+            session.recent.append(Message(session.next_seq, role, text, time.time()))
+            session.next_seq += 1
+            session.conversation.add(role, text)
+            session.last_seen = time.monotonic()
+
+    def older(self, session_id, limit=50):
+        # ข้อความที่ย้ายไป SQLite แล้ว (ใหม่สุด limit ข้อความ เรียงเก่า -> ใหม่)
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if self.db is None or session is None or not session.spilled:
+                return []
+            rows = self.db.execute(
+                "SELECT seq, role, text, at FROM turns WHERE session_id = ? AND seq < ? ORDER BY seq DESC LIMIT ?",
+                (session_id, session.spilled, limit)
+            ).fetchall()
+        return [Message(*row) for row in reversed(rows)]
+
+    def reset(self, session_id):
+        # ลืม session ทั้งในหน่วยความจำและใน SQLite
+        with self.lock:
+            found = self.sessions.pop(session_id, None) is not None
+            if self.db is not None:
+                found = self.db.execute("DELETE FROM turns WHERE session_id = ?", (session_id,)).rowcount > 0 or found
+                self.db.commit()
+            return found
+
+    def maybe_sweep(self):
+        if time.monotonic() - self.last_sweep >= min(SWEEP_INTERVAL, self.ttl):
+            self.evict_idle()
+
+    def evict_idle(self, now=None):
+        # เอา session ที่เงียบเกิน ttl ออกจากหน่วยความจำ (ข้อความที่เหลือใน ring buffer ย้ายไป SQLite ก่อน)
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.last_sweep = now
+            idle = [s for s in self.sessions.values() if now - s.last_seen > self.ttl]
+            for session in idle:
+                self._spill(session.id, session.recent)
+                del self.sessions[session.id]
+            self.evicted += len(idle)
+            if idle and self.db is not None and self.retention:
+                self.db.execute("DELETE FROM turns WHERE at < ?", (time.time() - self.retention,))
+                self.db.commit()
+        return [s.id for s in idle]
+
+    def _spill(self, session_id, messages):
+        if self.db is None or not messages:
+            return
+        # INSERT OR IGNORE: ข้อความที่โหลดกลับมาจาก SQLite แล้วถูก spill ซ้ำ ไม่เกิดแถวซ้ำ
+        cursor = self.db.executemany(
+            "INSERT OR IGNORE INTO turns (session_id, seq, role, text, at) VALUES (?, ?, ?, ?, ?)",
+            [(session_id, m.seq, m.role, m.text, m.at) for m in messages]
+        )
+        self.spilled += max(0, cursor.rowcount)
+        self.db.commit()
+
+    def _restore(self, session_id):
+        session = Session(session_id, self.recent_turns)
+        if self.db is None:
+            return session
+        rows = self.db.execute(
+            "SELECT seq, role, text, at FROM turns WHERE session_id = ? ORDER BY seq DESC LIMIT ?",
+            (session_id, self.recent_turns)
+        ).fetchall()
+        if rows:
+            # ประวัติสำหรับ prompt สร้างใหม่จากข้อความล่าสุด (ส่วนที่เก่ากว่านั้นเหลือแค่ใน SQLite)
+            for row in reversed(rows):
+                session.recent.append(Message(*row))
+                session.conversation.add(row[1], row[2])
+            session.next_seq = rows[0][0] + 1
+            self.restored += 1
+        return session
+
+    def stats(self):
+        with self.lock:
+            sizes = [s.nbytes() for s in self.sessions.values()]
+        return {
+            "sessions": len(sizes),
+            "resident_bytes": sum(sizes),
+            "bytes_per_session": sum(sizes) / len(sizes) if sizes else 0,
+            "max_session_bytes": max(sizes, default=0),
+            "spilled_turns": self.spilled,
+            "evicted": self.evicted,
+            "restored": self.restored,
+        }
+
+
+store = SessionStore()
+metrics.register("sessions", store.stats)
@@ -0,0 +1,42 @@
+-- match_products ที่กรองด้วย metadata ก่อนจัดอันดับด้วย vector (ใช้โดย retrieval.py เมื่อคำถามมีเงื่อนไข)
+-- รันใน Supabase SQL Editor ครั้งเดียว, metadata brand / device / film_type มาจาก build_brain.py
+-- ราคาที่ไม่ใช่ตัวเลข (เช่น "-") กลายเป็น null ไม่ผ่านเงื่อนไขราคา แทนที่จะทำให้ทั้ง query error
+-- (ใช้ case เพราะ Postgres ไม่รับประกันลำดับการประเมิน and)
+
+create index if not exists product_embeddings_brand_idx on product_embeddings ((metadata->>'brand'));
+create index if not exists product_embeddings_device_idx on product_embeddings ((metadata->>'device'));
+create index if not exists product_embeddings_film_type_idx on product_embeddings ((metadata->>'film_type'));
+
+create or replace function match_products_filtered (
+  query_embedding vector(768),
+  match_threshold float,
+  match_count int,
+  filter_brand text default null,
+  filter_devices text[] default null,
+  filter_film_type text default null,
+  min_price numeric default null,
+  max_price numeric default null
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float
+)
+language sql stable
+as $$
+  select
+    product_embeddings.id,
+    product_embeddings.content,
+    product_embeddings.metadata,
+    1 - (product_embeddings.embedding <=> query_embedding) as similarity
+  from product_embeddings
+  where (filter_brand is null or metadata->>'brand' = filter_brand)
+    and (filter_devices is null or metadata->>'device' = any(filter_devices))
+    and (filter_film_type is null or metadata->>'film_type' = filter_film_type)
+    and (min_price is null or (case when metadata->>'price' ~ '^[0-9]+(\.[0-9]+)?$' then (metadata->>'price')::numeric end) >= min_price)
+    and (max_price is null or (case when metadata->>'price' ~ '^[0-9]+(\.[0-9]+)?$' then (metadata->>'price')::numeric end) <= max_price)
+    and 1 - (product_embeddings.embedding <=> query_embedding) > match_threshold
+  order by product_embeddings.embedding <=> query_embedding
+  limit match_count;
+$$;
@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+from metrics import metrics
+
+# ดัชนี vector ในเครื่อง (แทนการเรียก RPC match_products ทุกครั้ง)
+# เก็บ vector ทั้งหมดเป็น matrix float32 ที่ normalize แล้ว ในไฟล์ .npy แบบ memory-mapped
+INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", ".vector_index")
+MANIFEST = "manifest.json"
+PAGE_SIZE = 1000
+
+# รูปแบบย่อขนาดสำหรับสแกน (เก็บ float32 เต็มไว้ในไฟล์ mmap สำหรับคำนวณคะแนนจริงของผู้เข้ารอบ)
+# float32 = ไม่ย่อ, float16 = ครึ่งหนึ่ง, int8 = 1/4 (+ scale ต่อแถว)
+VECTOR_FORMAT = os.getenv("VECTOR_FORMAT", "float32").lower()
+VECTOR_DIMS = int(os.getenv("VECTOR_DIMS", "0"))           # ตัดเหลือกี่มิติแรก (0 = ไม่ตัด)
+RESCORE_FACTOR = int(os.getenv("VECTOR_RESCORE_FACTOR", "4"))  # ผู้เข้ารอบ = match_count x เท่านี้
+SCAN_CHUNK = 4096  # จำนวนแถวต่อรอบเวลาสแกนแบบย่อ (แปลงเป็น float32 ทีละก้อนเล็กๆ ให้อยู่ใน cache)
+FORMATS = ("float32", "float16", "int8")
+
+
+def parse_embedding(value):
+    # pgvector ผ่าน PostgREST ส่งกลับมาเป็น string "[0.1,0.2,...]"
+    if isinstance(value, str):
+        return json.loads(value)
+    return value
+
+
+def normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def quantize(vectors, fmt=VECTOR_FORMAT, dims=VECTOR_DIMS):
+    # คืน (matrix แบบย่อ, scale ต่อแถว หรือ None) จาก vector ที่ normalize แล้ว
+    if fmt not in FORMATS:
+        raise ValueError(f"VECTOR_FORMAT ต้องเป็น {', '.join(FORMATS)} (ได้ {fmt})")
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dims and dims < vectors.shape[-1]:
+        # ตัดมิติท้ายทิ้งแล้ว normalize ใหม่ (text-embedding-004 เรียงมิติสำคัญไว้ต้นๆ)
+        vectors = normalize(vectors[:, :dims])
+    if fmt == "float16":
+        return vectors.astype(np.float16), None
+    if fmt == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.rint(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return vectors, None
+
+
+def iter_pages(make_query, key="id", page_size=PAGE_SIZE):
+    # อ่านทีละหน้าแบบ keyset (id > id สุดท้ายของหน้าก่อน) ไม่ติดลิมิตจำนวนแถวของ PostgREST
+    # และไม่ช้าลงเรื่อยๆ แบบ offset เมื่อ catalog ใหญ่ขึ้น
+    last = None
+    while True:
+        query = make_query()
+        if last is not None:
+            query = query.gt(key, last)
+        with metrics.span("brain_fetch_page"):
+            page = query.order(key).limit(page_size).execute().data
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        last = page[-1][key]
+
+
+def build_snapshot(supabase, index_dir=INDEX_DIR, page_size=PAGE_SIZE):
+    # ดึง product_embeddings ทีละหน้าจาก Supabase แล้วเขียน snapshot ใหม่
+    # vector ของแต่ละหน้าแปลงเป็น float32 แล้วต่อท้ายไฟล์ชั่วคราวทันที ไม่เก็บแถวดิบทั้งหมดไว้ในหน่วยความจำ
+    os.makedirs(index_dir, exist_ok=True)
+    raw_path = os.path.join(index_dir, "building.f32")
+    items = []
+    dim = 0
+    pages = iter_pages(lambda: supabase.table("product_embeddings").select("id, content, metadata, embedding"),
+                       page_size=page_size)
+    with open(raw_path, "wb") as raw:
+        for page in pages:
+            block = normalize([parse_embedding(r["embedding"]) for r in page])
+            dim = block.shape[1]
+            raw.write(block.tobytes())
+            items.extend({"id": r.get("id"), "content": r["content"], "metadata": r.get("metadata") or {}} for r in page)
+
+    try:
+        if items:
+            vectors = np.memmap(raw_path, dtype=np.float32, mode="r", shape=(len(items), dim))
+        else:
+            vectors = np.zeros((0, 0), np.float32)
+        write_snapshot(vectors, items, index_dir)
+        del vectors
+    finally:
+        os.remove(raw_path)
+    return len(items)
+
+
+def write_snapshot(vectors, items, index_dir=INDEX_DIR, fmt=VECTOR_FORMAT, dims=VECTOR_DIMS):
+    # เขียนไฟล์ชุดใหม่ก่อน แล้วค่อยสลับ manifest ทีเดียว (ผู้อ่านจะไม่เจอไฟล์ครึ่งๆ กลางๆ)
+    os.makedirs(index_dir, exist_ok=True)
+    version = str(time.time_ns())
+    vectors_file = f"vectors-{version}.npy"
+    items_file = f"items-{version}.json"
+    manifest = {"version": version, "vectors": vectors_file, "items": items_file, "count": len(items), "format": "float32"}
+
+    np.save(os.path.join(index_dir, vectors_file), np.ascontiguousarray(vectors, dtype=np.float32))
+    with open(os.path.join(index_dir, items_file), "w", encoding="utf-8") as f:
+        json.dump(items, f, ensure_ascii=False)
+
+    if len(items) and (fmt != "float32" or dims):
+        compact, scales = quantize(vectors, fmt, dims)
+        manifest.update(format=fmt, dims=int(compact.shape[1]), compact=f"compact-{version}.npy")
+        np.save(os.path.join(index_dir, manifest["compact"]), compact)
+        if scales is not None:
+            manifest["scales"] = f"scales-{version}.npy"
+            np.save(os.path.join(index_dir, manifest["scales"]), scales)
+
+    manifest_path = os.path.join(index_dir, MANIFEST)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    # ลบ snapshot เก่า (ไฟล์ที่ถูก mmap อยู่ยังใช้ต่อได้จนกว่าจะปิด)
+    for name in os.listdir(index_dir):
+        if name.startswith(("vectors-", "items-", "compact-", "scales-")) and version not in name:
+            try:
+                os.remove(os.path.join(index_dir, name))
+            except OSError:
+                pass
+
+
+class VectorIndex:
+    def __init__(self, index_dir=INDEX_DIR):
+        with open(os.path.join(index_dir, MANIFEST), encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.version = manifest["version"]
+        self.vectors = np.load(os.path.join(index_dir, manifest["vectors"]), mmap_mode="r")
+        with open(os.path.join(index_dir, manifest["items"]), encoding="utf-8") as f:
+            self.items = json.load(f)
+        # แบบย่อโหลดเข้าหน่วยความจำ (ใช้สแกนทุกแถว) ส่วน float32 เต็มอ่านจาก mmap เฉพาะแถวที่เข้ารอบ
+        self.format = manifest.get("format", "float32")
+        self.compact = self.scales = None
+        if manifest.get("compact"):
+            self.compact = np.load(os.path.join(index_dir, manifest["compact"]))
+        if manifest.get("scales"):
+            self.scales = np.load(os.path.join(index_dir, manifest["scales"]))
+
+    @classmethod
+    def from_arrays(cls, vectors, items, fmt="float32", dims=0):
+        # สร้าง index จากข้อมูลในหน่วยความจำ (ไม่อ่านไฟล์) ใช้กับตัวจำลอง/benchmark
+        index = cls.__new__(cls)
+        index.version = "memory"
+        index.vectors = normalize(vectors)
+        index.items = items
+        index.format = fmt
+        index.compact = index.scales = None
+        if len(items) and (fmt != "float32" or dims):
+            index.compact, index.scales = quantize(index.vectors, fmt, dims)
+        return index
+
+    def nbytes(self):
+        # ขนาดข้อมูลที่ต้องสแกนต่อคำถาม
+        if self.compact is None:
+            return int(self.vectors.nbytes)
+        return int(self.compact.nbytes + (self.scales.nbytes if self.scales is not None else 0))
+
+    def __len__(self):
+        return len(self.items)
+
+    def _columns(self):
+        # คอลัมน์ metadata ที่ใช้กรอง สร้างครั้งแรกที่มีการกรอง
+        if getattr(self, "_filter_columns", None) is None:
+            metas = [item["metadata"] for item in self.items]
+            prices = []
+            for meta in metas:
+                try:
+                    prices.append(float(meta.get("price")))
+                except (TypeError, ValueError):
+                    prices.append(np.nan)
+            self._filter_columns = {
+                "brand": np.array([meta.get("brand") for meta in metas], dtype=object),
+                "device": np.array([meta.get("device") for meta in metas], dtype=object),
+                "film_type": np.array([meta.get("film_type") for meta in metas], dtype=object),
+                "price": np.array(prices, dtype=np.float64),
+            }
+        return self._filter_columns
+
+    def candidates(self, filters):
+        # แถวที่ผ่านเงื่อนไข (query_filters.parse_filters) คืน None ถ้าไม่มีเงื่อนไข
+        if not filters:
+            return None
+        columns = self._columns()
+        mask = np.ones(len(self.items), dtype=bool)
+        if "brand" in filters:
+            mask &= columns["brand"] == filters["brand"]
+        if "devices" in filters:
+            mask &= np.isin(columns["device"], list(filters["devices"]))
+        if "film_type" in filters:
+            mask &= columns["film_type"] == filters["film_type"]
+        # ราคาเป็น NaN จะเทียบได้ False เสมอ (ไม่ผ่านเงื่อนไขราคา)
+        if "min_price" in filters:
+            mask &= columns["price"] >= filters["min_price"]
+        if "max_price" in filters:
+            mask &= columns["price"] <= filters["max_price"]
+        return np.flatnonzero(mask)
+
+    def search(self, query_embedding, match_threshold=0.35, match_count=5, filters=None):
+        # ความหมายเดียวกับ RPC match_products: cosine similarity > threshold, เรียงมากไปน้อย
+        # filters: กรองด้วย metadata ก่อน แล้วค่อยคำนวณ similarity เฉพาะแถวที่เหลือ
+        if len(self.items) == 0 or match_count <= 0:
+            return []
+
+        rows = self.candidates(filters)
+        if rows is not None and len(rows) == 0:
+            return []
+
+        query = normalize(query_embedding)
+        if self.compact is None:
+            scores = (self.vectors if rows is None else self.vectors[rows]) @ query
+            return self._results(self._top(scores, match_count), scores, rows, match_threshold)
+
+        # สแกนแบบย่อหาผู้เข้ารอบ แล้วคำนวณคะแนนจริงด้วย float32 เต็มเฉพาะผู้เข้ารอบ
+        approx = self._approx_scores(query, rows)
+        shortlist = np.sort(self._top(approx, match_count * max(1, RESCORE_FACTOR)))
+        positions = shortlist if rows is None else rows[shortlist]
+        exact = self.vectors[positions] @ query
+        order = self._top(exact, match_count)
+        return self._results(order, exact, positions, match_threshold)
+
+    def _approx_scores(self, query, rows):
+        query = normalize(query[:self.compact.shape[1]])
+        n = len(self.items) if rows is None else len(rows)
+        scores = np.empty(n, dtype=np.float32)
+        for start in range(0, n, SCAN_CHUNK):
+            part = slice(start, min(n, start + SCAN_CHUNK))
+            block_rows = part if rows is None else rows[part]
+            scores[part] = self.compact[block_rows].astype(np.float32) @ query
+            if self.scales is not None:
+                scores[part] *= self.scales[block_rows]
+        return scores
+
+    @staticmethod
+    def _top(scores, count):
+        # argpartition หา top-k โดยไม่ต้อง sort ทั้ง matrix
+        if count < len(scores):
+            top = np.argpartition(-scores, count - 1)[:count]
+        else:
+            top = np.arange(len(scores))
+        return top[np.argsort(-scores[top])]
+
+    def _results(self, top, scores, rows, match_threshold):
+        results = []
+        for i in top:
+            score = float(scores[i])
+            if score <= match_threshold:
+                break
+            item = self.items[i if rows is None else rows[i]]
+            results.append({
+                "id": item["id"],
+                "content": item["content"],
+                "metadata": item["metadata"],
+                "similarity": score,
+            })
+        return results
+
+
+_index = None
+_index_mtime = None
+_lock = threading.Lock()
+
+
+def get_index(supabase=None, index_dir=INDEX_DIR):
+    # โหลด snapshot (และโหลดใหม่อัตโนมัติเมื่อ build_brain.py เขียน snapshot ใหม่)
+    global _index, _index_mtime
+    manifest_path = os.path.join(index_dir, MANIFEST)
+
+    with _lock:
+        if not os.path.exists(manifest_path):
+            if supabase is None:
+                return None
+            print("📥 ยังไม่มี vector index ในเครื่อง กำลังสร้างจาก Supabase...")
+            build_snapshot(supabase, index_dir)
+
+        mtime = os.path.getmtime(manifest_path)
+        if _index is None or mtime != _index_mtime:
+            _index = VectorIndex(index_dir)
+            _index_mtime = mtime
+        return _index